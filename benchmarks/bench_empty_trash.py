@@ -0,0 +1,83 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks for empty-trash command."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+from lsst.daf.butler_admin.script import empty_trash
+
+from .synthetic import SIZES, copy_repo, template_repo, use_cache_dir
+
+
+class EmptyTrashDryRun:
+    """Report reclaimable space without removing anything."""
+
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup(self, size: str) -> None:
+        self.repo = template_repo(size)
+        self.tmpdir = tempfile.mkdtemp()
+        self.restore_cache_dir = use_cache_dir(self.tmpdir)
+
+    def teardown(self, size: str) -> None:
+        self.restore_cache_dir()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_dry_run(self, size: str) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            empty_trash(self.repo, verbose=False, dry_run=True)
+
+
+class EmptyTrash:
+    """Remove all trashed artifacts."""
+
+    params = (list(SIZES), [1, 4])
+    param_names = ["size", "jobs"]
+    timeout = 600
+    # Each sample empties a fresh copy of the repository.
+    number = 1
+    warmup_time = 0
+
+    def setup(self, size: str, jobs: int) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.restore_cache_dir = use_cache_dir(self.tmpdir)
+        self.repo = copy_repo(size, os.path.join(self.tmpdir, "repo"))
+
+    def teardown(self, size: str, jobs: int) -> None:
+        self.restore_cache_dir()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_empty_trash(self, size: str, jobs: int) -> None:
+        empty_trash(
+            self.repo,
+            verbose=False,
+            dry_run=False,
+            batch_size=1000,
+            jobs=jobs,
+        )
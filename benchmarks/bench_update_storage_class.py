@@ -0,0 +1,70 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks for update-storage-class command."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+
+from lsst.daf.butler_admin.script import update_storage_class
+
+from .synthetic import SIZES, copy_repo, template_repo
+
+
+class UpdateStorageClassDryRun:
+    """Match dataset types and report impact without updating."""
+
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+
+    def setup(self, size: str) -> None:
+        self.repo = template_repo(size)
+
+    def time_dry_run(self, size: str) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            update_storage_class(self.repo, False, "*_metadata", "StructuredDataDict", "Packages")
+
+
+class UpdateStorageClass:
+    """Update storage class of all synthetic dataset types."""
+
+    params = list(SIZES)
+    param_names = ["size"]
+    timeout = 600
+    # Each sample updates a fresh copy of the repository.
+    number = 1
+    warmup_time = 0
+
+    def setup(self, size: str) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = copy_repo(size, os.path.join(self.tmpdir, "repo"))
+
+    def teardown(self, size: str) -> None:
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_update(self, size: str) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            update_storage_class(self.repo, True, "*_metadata", "StructuredDataDict", "Packages")
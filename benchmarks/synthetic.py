@@ -0,0 +1,284 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Generator of synthetic butler repositories for benchmarks."""
+
+from __future__ import annotations
+
+__all__ = ["SIZES", "RepoSize", "copy_repo", "make_repo", "template_repo", "use_cache_dir"]
+
+import os
+import shutil
+import tempfile
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from lsst.daf.butler import Butler, CollectionType, DatasetType, Timespan
+
+# Name of the instrument used in all data IDs.
+INSTRUMENT = "Synth"
+
+# Dataset type of trashed datasets.
+TRASH_DATASET_TYPE = "synth_trash"
+
+# Dimensions of dataset types, used in turn. Each group has its own dataset
+# tags table.
+DIMENSION_GROUPS = (
+    ("instrument", "detector"),
+    ("instrument", "physical_filter"),
+    ("instrument", "detector", "physical_filter"),
+)
+
+# One of this number of consecutive dataset types is a calibration.
+CALIBRATION_STRIDE = 5
+
+# CALIBRATION collection with datasets of calibration dataset types from the
+# first run.
+CALIBRATION_COLLECTION = "synth/calib"
+
+# Version of repository contents, included in the names of template
+# repositories so that repositories made by older versions are not reused.
+LAYOUT_VERSION = 2
+
+
+@dataclass(frozen=True)
+class RepoSize:
+    """Size parameters of a synthetic repository."""
+
+    collections: int
+    """Number of RUN collections."""
+
+    dataset_types: int
+    """Number of dataset types, all of them exist in every collection.
+    Calibration dataset types are also certified in one CALIBRATION
+    collection.
+    """
+
+    datasets: int
+    """Number of datasets of each dataset type in each collection."""
+
+    trash: int
+    """Number of datasets with artifacts in datastore trash."""
+
+    def __str__(self) -> str:
+        return f"{self.collections}x{self.dataset_types}x{self.datasets}_{self.trash}"
+
+
+# Repository sizes used as benchmark parameters.
+SIZES = {
+    "small": RepoSize(collections=10, dataset_types=5, datasets=10, trash=100),
+    "medium": RepoSize(collections=50, dataset_types=20, datasets=100, trash=1_000),
+    "large": RepoSize(collections=100, dataset_types=50, datasets=200, trash=10_000),
+}
+
+
+def make_repo(root: str, size: RepoSize) -> str:
+    """Create a synthetic SQLite butler repository.
+
+    Parameters
+    ----------
+    root : `str`
+        Root directory of the new repository, must not exist or be empty.
+    size : `RepoSize`
+        Size of the repository.
+
+    Returns
+    -------
+    root : `str`
+        Root directory of the repository.
+
+    Notes
+    -----
+    Dataset types are named ``synth_NNN_metadata`` and have
+    ``StructuredDataDict`` storage class, their dimensions cycle through
+    `DIMENSION_GROUPS`, and every `CALIBRATION_STRIDE`-th of them is a
+    calibration, so that registry has several tags tables and a calibs
+    table. Datasets of calibration dataset types from the first run are
+    certified in `CALIBRATION_COLLECTION`. Datasets are only registered,
+    without any artifacts, which is enough for commands that only look at
+    the registry. Trashed datasets are written with ``put``, then trashed
+    and removed from registry as ``pruneDatasets`` does, so that their
+    artifacts exist and can be removed from datastore trash.
+    """
+    Butler.makeRepo(root)
+    with Butler.from_config(root, writeable=True) as butler:
+        n_detectors = max(size.datasets, min(size.trash, 1000))
+        butler.registry.insertDimensionData("instrument", {"name": INSTRUMENT, "detector_max": n_detectors})
+        butler.registry.insertDimensionData(
+            "detector",
+            *[
+                {"instrument": INSTRUMENT, "id": detector, "full_name": f"D{detector:04d}"}
+                for detector in range(n_detectors)
+            ],
+        )
+        butler.registry.insertDimensionData(
+            "physical_filter",
+            *[
+                {"instrument": INSTRUMENT, "name": f"F{index:04d}", "band": "b"}
+                for index in range(size.datasets)
+            ],
+        )
+
+        dataset_types = [
+            DatasetType(
+                f"synth_{index:03d}_metadata",
+                butler.dimensions.conform(DIMENSION_GROUPS[index % len(DIMENSION_GROUPS)]),
+                "StructuredDataDict",
+                isCalibration=index % CALIBRATION_STRIDE == CALIBRATION_STRIDE - 1,
+            )
+            for index in range(size.dataset_types)
+        ]
+        for dataset_type in dataset_types:
+            butler.registry.registerDatasetType(dataset_type)
+
+        # Detector and physical filter of the same index, only the
+        # dimensions of a dataset type are used.
+        data_ids = [
+            {"instrument": INSTRUMENT, "detector": index, "physical_filter": f"F{index:04d}"}
+            for index in range(size.datasets)
+        ]
+        butler.collections.register(CALIBRATION_COLLECTION, CollectionType.CALIBRATION)
+        for index in range(size.collections):
+            run = f"synth/run{index:04d}"
+            butler.collections.register(run)
+            for dataset_type in dataset_types:
+                refs = butler.registry.insertDatasets(
+                    dataset_type,
+                    [
+                        {name: data_id[name] for name in dataset_type.dimensions.required}
+                        for data_id in data_ids
+                    ],
+                    run=run,
+                )
+                if index == 0 and dataset_type.isCalibration():
+                    butler.registry.certify(CALIBRATION_COLLECTION, refs, Timespan(None, None))
+
+        if size.trash:
+            trash_type = DatasetType(
+                TRASH_DATASET_TYPE, butler.dimensions.conform(DIMENSION_GROUPS[0]), "StructuredDataDict"
+            )
+            butler.registry.registerDatasetType(trash_type)
+            refs = []
+            for index in range(size.trash):
+                run = f"synth/trash{index // n_detectors:04d}"
+                if index % n_detectors == 0:
+                    butler.collections.register(run)
+                refs.append(
+                    butler.put(
+                        {"index": index},
+                        trash_type,
+                        instrument=INSTRUMENT,
+                        detector=index % n_detectors,
+                        run=run,
+                    )
+                )
+            # Low-level API, pruneDatasets would also empty the trash.
+            butler._datastore.trash(refs)
+            butler._registry.removeDatasets(refs)
+    return root
+
+
+def use_cache_dir(path: str) -> Callable[[], None]:
+    """Make commands write their local cache files to a given directory.
+
+    Parameters
+    ----------
+    path : `str`
+        Directory used instead of the user cache directory.
+
+    Returns
+    -------
+    restore : `~collections.abc.Callable`
+        Function that restores previous cache directory, to be called from
+        benchmark ``teardown``.
+    """
+    old_value = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = path
+
+    def restore() -> None:
+        if old_value is None:
+            os.environ.pop("XDG_CACHE_HOME", None)
+        else:
+            os.environ["XDG_CACHE_HOME"] = old_value
+
+    return restore
+
+
+def template_repo(name: str) -> str:
+    """Return a synthetic repository of a given size, creating it if needed.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the size in `SIZES`.
+
+    Returns
+    -------
+    root : `str`
+        Root directory of the repository. It must not be modified, use
+        `copy_repo` for benchmarks that update the repository.
+
+    Notes
+    -----
+    Repositories are created in ``$DAF_BUTLER_ADMIN_BENCHMARK_DIR`` or in
+    the system temporary directory, and are reused by later runs.
+    """
+    cache_dir = os.environ.get("DAF_BUTLER_ADMIN_BENCHMARK_DIR") or os.path.join(
+        tempfile.gettempdir(), "daf_butler_admin_benchmarks"
+    )
+    root = os.path.join(cache_dir, f"{name}-{SIZES[name]}-v{LAYOUT_VERSION}")
+    if not os.path.exists(os.path.join(root, "butler.yaml")):
+        # Build in a temporary location first so that interrupted runs do not
+        # leave incomplete repositories behind.
+        os.makedirs(cache_dir, exist_ok=True)
+        shutil.rmtree(root, ignore_errors=True)
+        tmp_root = tempfile.mkdtemp(dir=cache_dir)
+        make_repo(tmp_root, SIZES[name])
+        os.rename(tmp_root, root)
+    return root
+
+
+def copy_repo(name: str, destination: str) -> str:
+    """Copy a synthetic repository to a new location.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the size in `SIZES`.
+    destination : `str`
+        Directory for the copy, must not exist.
+
+    Returns
+    -------
+    root : `str`
+        Root directory of the copy.
+    """
+    shutil.copytree(template_repo(name), destination)
+    return destination
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Create repositories ahead of benchmark runs, large ones take minutes.
+    for name in sys.argv[1:] or SIZES:
+        print(template_repo(name))
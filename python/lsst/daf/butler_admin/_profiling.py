@@ -0,0 +1,206 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+__all__ = ["Profiler", "phase"]
+
+import contextlib
+import cProfile
+import json
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from typing import Any
+
+# Profiler of the running command, `None` if profiling is disabled.
+_profiler: Profiler | None = None
+
+# Name used for SQL statements executed outside of any phase.
+_NO_PHASE = "(no phase)"
+
+
+@dataclass
+class _PhaseStats:
+    """Accumulated statistics of one phase."""
+
+    calls: int = 0
+    """Number of times the phase was entered."""
+
+    wall_time: float = 0.0
+    """Total wall time in seconds, including nested phases."""
+
+    sql_count: int = 0
+    """Number of SQL statements executed in this phase, excluding nested
+    phases."""
+
+    sql_time: float = 0.0
+    """Total duration of SQL statements in seconds, excluding nested
+    phases."""
+
+
+class Profiler:
+    """Profiler recording wall time and SQL statements per phase.
+
+    Parameters
+    ----------
+    command : `str`
+        Name of the profiled command.
+    cprofile : `bool`, optional
+        If `True` then also run `cProfile` profiler.
+
+    Notes
+    -----
+    SQL statements are counted using SQLAlchemy events of all engines, and
+    are attributed to the innermost phase that is active in the main thread,
+    including statements executed by worker threads. Only one profiler can be
+    active at a time.
+    """
+
+    def __init__(self, command: str, cprofile: bool = False):
+        self._command = command
+        self._cprofile = cProfile.Profile() if cprofile else None
+        self._phases: dict[str, _PhaseStats] = {}
+        self._stack: list[str] = []
+        self._lock = threading.Lock()
+        self._start = 0.0
+        self._wall_time = 0.0
+
+    def start(self) -> None:
+        """Start profiling."""
+        global _profiler
+        import sqlalchemy
+
+        if _profiler is not None:
+            raise RuntimeError("Another profiler is already active.")
+        _profiler = self
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, "before_cursor_execute", self._before_execute)
+        sqlalchemy.event.listen(sqlalchemy.engine.Engine, "after_cursor_execute", self._after_execute)
+        self._start = time.monotonic()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop(self) -> None:
+        """Stop profiling."""
+        global _profiler
+        import sqlalchemy
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._wall_time = time.monotonic() - self._start
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, "before_cursor_execute", self._before_execute)
+        sqlalchemy.event.remove(sqlalchemy.engine.Engine, "after_cursor_execute", self._after_execute)
+        _profiler = None
+
+    def summary(self) -> dict[str, Any]:
+        """Return summary of collected statistics.
+
+        Returns
+        -------
+        summary : `dict` [`str`, `typing.Any`]
+            Summary with command name, total wall time, total SQL statistics
+            and statistics of each phase, suitable for JSON serialization.
+        """
+        with self._lock:
+            phases = {name: asdict(stats) for name, stats in self._phases.items()}
+        return {
+            "command": self._command,
+            "wall_time": self._wall_time,
+            "sql_count": sum(stats["sql_count"] for stats in phases.values()),
+            "sql_time": sum(stats["sql_time"] for stats in phases.values()),
+            "phases": phases,
+        }
+
+    def write(self, summary_file: str | None, cprofile_file: str | None = None) -> None:
+        """Write collected statistics to files.
+
+        Parameters
+        ----------
+        summary_file : `str` or `None`
+            Name of the file for JSON summary.
+        cprofile_file : `str` or `None`, optional
+            Name of the file for `cProfile` statistics, which can be read
+            with `pstats` module.
+        """
+        if summary_file is not None:
+            with open(summary_file, "w") as file:
+                json.dump(self.summary(), file, indent=2)
+                file.write("\n")
+        if cprofile_file is not None and self._cprofile is not None:
+            self._cprofile.dump_stats(cprofile_file)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record wall time of a phase.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the phase, statistics of phases with the same name are
+            accumulated.
+        """
+        nested = threading.current_thread() is not threading.main_thread()
+        if not nested:
+            self._stack.append(name)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            if not nested:
+                self._stack.pop()
+            with self._lock:
+                stats = self._phases.setdefault(name, _PhaseStats())
+                stats.calls += 1
+                stats.wall_time += elapsed
+
+    def _before_execute(self, conn: Any, cursor: Any, statement: Any, *args: Any) -> None:
+        conn.info.setdefault("daf_butler_admin_start", []).append(time.monotonic())
+
+    def _after_execute(self, conn: Any, cursor: Any, statement: Any, *args: Any) -> None:
+        elapsed = time.monotonic() - conn.info["daf_butler_admin_start"].pop()
+        with self._lock:
+            name = self._stack[-1] if self._stack else _NO_PHASE
+            stats = self._phases.setdefault(name, _PhaseStats())
+            stats.sql_count += 1
+            stats.sql_time += elapsed
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Record wall time of a phase of the running command.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the phase.
+
+    Notes
+    -----
+    Does nothing unless profiling was enabled with ``--profile`` option.
+    """
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name):
+            yield
@@ -23,26 +23,145 @@ from typing import Any
 
 import click
 
-from lsst.daf.butler.cli.opt import repo_argument, verbose_option
+from lsst.daf.butler.cli.opt import collections_option, repo_argument, verbose_option
 from lsst.daf.butler.cli.utils import ButlerCommand, MWArgumentDecorator
 
-from ... import script
+# Script modules import butler internals, each command imports them when it
+# runs to keep startup of the butler command line fast.
 
 
 @click.group
-def admin() -> None:
+@click.option(
+    "--profile",
+    "profile_file",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Write JSON summary of wall time, number and duration of SQL statements for each phase of the "
+        "command to this file."
+    ),
+)
+@click.option(
+    "--cprofile",
+    "cprofile_file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Run command under cProfile and write its statistics to this file.",
+)
+@click.pass_context
+def admin(ctx: click.Context, profile_file: str | None, cprofile_file: str | None) -> None:
     """Run butler administration tasks."""
-    pass
+    if profile_file is not None or cprofile_file is not None:
+        from ..._profiling import Profiler
+
+        profiler = Profiler(ctx.invoked_subcommand or "", cprofile=cprofile_file is not None)
+        profiler.start()
+
+        def finish() -> None:
+            profiler.stop()
+            profiler.write(profile_file, cprofile_file)
+
+        ctx.call_on_close(finish)
 
 
 @admin.command(cls=ButlerCommand)
-@click.option("--update", help="Execute updates, by default only print statistics.", is_flag=True)
+@click.option(
+    "--update",
+    help="Remove stale summary records, by default only print statistics. Missing records are reported "
+    "by the check but are not added.",
+    is_flag=True,
+)
 @click.option(
     "--tagged", help="Only check tagged collections, ignored if --update is specified.", is_flag=True
 )
+@click.option(
+    "--method",
+    type=click.Choice(["aggregate", "probe", "query"]),
+    default="aggregate",
+    show_default=True,
+    help=(
+        "Method used to check summaries, ignored if --update is specified. 'aggregate' runs one aggregate "
+        "query per dataset table, 'probe' runs existence queries for each collection and dataset type, "
+        "'query' runs a dataset query for each collection (much slower)."
+    ),
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=(
+        "Number of parallel workers used by --method=query or by --update to query dataset tables, "
+        "each with its own database connection."
+    ),
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    help=(
+        "With --update, refresh summaries for this number of collections per transaction instead of "
+        "updating everything in one transaction."
+    ),
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help=(
+        "Checkpoint file for chunked update, requires --chunk-size. If the file exists then collections "
+        "updated by the interrupted run are skipped."
+    ),
+)
+@collections_option(
+    help=(
+        "Names or glob patterns of collections to check or update, can be specified multiple times or as a "
+        "comma-separated list. By default all collections are processed."
+    )
+)
+@click.option(
+    "--since",
+    help=(
+        "Only check or update collections with datasets ingested after this time, ISO format in UTC, "
+        "e.g. 2025-01-31T12:00:00."
+    ),
+)
+@click.option(
+    "--cache-file",
+    type=click.Path(dir_okay=False),
+    help=(
+        "File with cached check results, collections that did not change since previous check are not "
+        "checked again. By default a separate file for each repository in the user cache directory is "
+        "used. Not used by --method=aggregate."
+    ),
+)
+@click.option(
+    "--ignore-cache",
+    is_flag=True,
+    help="Check all collections, ignoring cached results of previous checks. Not used by --method=aggregate.",
+)
+@click.option(
+    "--recheck/--no-recheck",
+    default=True,
+    show_default=True,
+    help="Check inconsistent collections again to reduce false alarms caused by concurrent updates.",
+)
+@click.option(
+    "--format",
+    type=click.Choice(["text", "jsonl"]),
+    default="text",
+    show_default=True,
+    help=(
+        "Format of the check report, 'jsonl' writes one JSON record per collection with the names of extra "
+        "and missing dataset types."
+    ),
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File name for the check report, by default it is printed to standard output.",
+)
 @repo_argument(required=True)
 def refresh_collection_summary(**kwargs: Any) -> None:
     """Refresh contents of the collection summary tables."""
+    from ... import script
+
     script.refresh_collection_summary(**kwargs)
 
 
@@ -62,21 +181,197 @@ to_storage_class_argument = MWArgumentDecorator(
 
 @admin.command(cls=ButlerCommand)
 @click.option("--update", help="Execute updates, by default only print actions taken.", is_flag=True)
+@click.option(
+    "--mapping-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help=(
+        "YAML or CSV file with multiple mappings, each with dataset_type, from and to fields. "
+        "Replaces DATASET_TYPE, STORAGE_CLASS and TO_STORAGE_CLASS arguments."
+    ),
+)
+@click.option(
+    "--validate",
+    type=click.IntRange(min=0),
+    default=0,
+    metavar="N",
+    help=(
+        "Read up to N existing datasets of each matching dataset type with the new storage class and "
+        "report failures and read rate. Database is not updated if any dataset fails to read."
+    ),
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads used to read datasets for --validate, each with its own butler instance.",
+)
 @repo_argument(required=True)
-@dataset_type_glob_argument(required=True)
-@from_storage_class_argument(required=True)
-@to_storage_class_argument(required=True)
+@dataset_type_glob_argument(required=False)
+@from_storage_class_argument(required=False)
+@to_storage_class_argument(required=False)
 def update_storage_class(**kwargs: Any) -> None:
-    """Update storage class definition for some dataset types."""
+    """Update storage class definition for some dataset types.
+
+    Storage classes for all mappings are checked before any update is made,
+    and all dataset types are updated in a single transaction.
+    """
+    from ... import script
+
     script.update_storage_class(**kwargs)
 
 
 @admin.command(cls=ButlerCommand)
 @repo_argument(required=True)
-@verbose_option(help="Report URIs of removed artifacts.")
+@verbose_option(help="Report URIs of removed artifacts, after each processed batch unless --sort is given.")
+@click.option(
+    "--dry-run/--no-dry-run",
+    default=False,
+    help="Enable dry run mode and do not delete any datasets, report space that would be reclaimed.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    help="Process trash in batches of this many datasets, each batch is committed separately.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=(
+        "Number of threads used to remove artifacts, or to find artifact sizes for the dry-run report. "
+        "Failed removals are retried, datasets whose artifacts could not be removed are left in trash."
+    ),
+)
+@click.option(
+    "--max-seconds",
+    type=click.FloatRange(min=0),
+    help="Stop removing artifacts after this number of seconds and report what is left in trash.",
+)
+@click.option(
+    "--max-artifacts",
+    type=click.IntRange(min=0),
+    help="Stop after removing this number of artifacts and report what is left in trash.",
+)
+@click.option(
+    "--older-than",
+    help=(
+        "Only remove datasets that were in trash for at least this time, e.g. '7d' (units: s, m, h, d, w). "
+        "Trash time is approximated by the time when dataset was first seen in trash by this command, "
+        "recorded in a ledger file that has to be kept between runs."
+    ),
+)
+@click.option(
+    "--ledger-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Ledger of trashed datasets used by --older-than, by default a separate file for each repository "
+        "in the user cache directory is used."
+    ),
+)
 @click.option(
-    "--dry-run/--no-dry-run", default=False, help="Enable dry run mode and do not delete any datasets."
+    "--sort", is_flag=True, help="Report URIs of removed artifacts sorted, after all trash is processed."
+)
+@click.option(
+    "--log-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write URIs of removed artifacts to this file instead of standard output, implies --verbose.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue interrupted run, artifacts recorded in the journal as removed are not removed again.",
+)
+@click.option(
+    "--journal-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Journal of removed artifacts, by default a separate file for each repository in the user cache "
+        "directory is used. Only one process can use the journal at a time."
+    ),
 )
 def empty_trash(**kwargs: Any) -> None:
     """Force the trash table to be emptied."""
+    from ... import script
+
     script.empty_trash(**kwargs)
+
+
+@admin.command(cls=ButlerCommand)
+@repo_argument(required=True)
+@click.option(
+    "--by-age",
+    is_flag=True,
+    help=(
+        "Also report numbers of datasets by time in trash, as used by empty-trash --older-than. This reads "
+        "all trashed dataset IDs, its cost grows with the size of the trash."
+    ),
+)
+@click.option(
+    "--ledger-file",
+    type=click.Path(dir_okay=False),
+    help=(
+        "Ledger of trashed datasets written by empty-trash --older-than, used by --by-age. By default a "
+        "separate file for each repository in the user cache directory is used."
+    ),
+)
+def trash_stats(**kwargs: Any) -> None:
+    """Report numbers of datasets in the datastore trash tables.
+
+    By default only aggregate queries are used, which is cheap to run.
+    """
+    from ... import script
+
+    script.trash_stats(**kwargs)
+
+
+@admin.command(cls=ButlerCommand)
+@click.option("--repo", help="URI of butler repository, overrides repository defined in the plan.")
+@click.argument("plan", type=click.Path(exists=True, dir_okay=False))
+def batch(**kwargs: Any) -> None:
+    """Run admin commands from PLAN file with one butler.
+
+    PLAN is a YAML file with "repo" key and "steps" key, a list of commands
+    to run in order. Each step is a mapping of command name to a mapping of
+    its options, e.g. "- empty-trash: {batch-size: 1000}". Execution stops at
+    the first failed step.
+    """
+    from ... import script
+
+    script.batch(**kwargs)
+
+
+# Options after COMMAND belong to it, even if fanout has options with the
+# same names.
+@admin.command(
+    cls=ButlerCommand, context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False}
+)
+@click.option(
+    "--repos",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="File with URIs of butler repositories, one per line.",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of repositories processed at the same time, each in a separate process.",
+)
+@click.argument("command")
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+def fanout(**kwargs: Any) -> None:
+    """Run admin COMMAND on every repository in a file.
+
+    Repository URI is passed to COMMAND as its first argument, or replaces
+    "{repo}" in ARGS. Output of each command is printed when it finishes,
+    followed by a summary. Exit status is non-zero if any command failed.
+    Default local state files of commands are separate for each repository,
+    files given explicitly in ARGS are shared by all of them.
+    """
+    from ... import script
+
+    if script.fanout(**kwargs):
+        raise click.exceptions.Exit(1)
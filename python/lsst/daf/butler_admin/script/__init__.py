@@ -19,6 +19,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from .batch import batch
 from .empty_trash import empty_trash
+from .fanout import fanout
 from .refresh_collection_summary import refresh_collection_summary
+from .trash_stats import trash_stats
 from .update_storage_class import update_storage_class
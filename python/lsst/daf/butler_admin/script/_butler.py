@@ -0,0 +1,89 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+__all__ = ["open_butler", "shared_butler"]
+
+import contextlib
+from collections.abc import Iterator
+from contextvars import ContextVar
+
+from lsst.daf.butler import Butler
+
+from .._profiling import phase
+
+# Repository URI and butler that are shared by all scripts in a batch.
+_shared_butler: ContextVar[tuple[str, Butler] | None] = ContextVar("_shared_butler", default=None)
+
+
+@contextlib.contextmanager
+def open_butler(repo: str, writeable: bool = True) -> Iterator[Butler]:
+    """Create butler for a repository and close it on exit.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+    writeable : `bool`, optional
+        If `True` then butler can update repository.
+
+    Yields
+    ------
+    butler : `lsst.daf.butler.Butler`
+        Data butler.
+
+    Notes
+    -----
+    Inside `shared_butler` context for the same repository the shared butler
+    is returned instead, it is not closed on exit.
+    """
+    shared = _shared_butler.get()
+    if shared is not None and shared[0] == repo:
+        yield shared[1]
+        return
+    with phase("butler"):
+        butler = Butler.from_config(repo, writeable=writeable)
+    with butler:
+        yield butler
+
+
+@contextlib.contextmanager
+def shared_butler(repo: str) -> Iterator[Butler]:
+    """Create writeable butler which is reused by `open_butler`.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+
+    Yields
+    ------
+    butler : `lsst.daf.butler.Butler`
+        Data butler, closed on exit.
+    """
+    with open_butler(repo) as butler:
+        token = _shared_butler.set((repo, butler))
+        try:
+            yield butler
+        finally:
+            _shared_butler.reset(token)
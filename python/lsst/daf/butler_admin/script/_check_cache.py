@@ -0,0 +1,217 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+__all__ = ["CheckCache", "default_cache_dir", "default_cache_file"]
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from types import TracebackType
+from typing import Self
+
+_LOG = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> str:
+    """Return default location of the directory for local cache files.
+
+    Returns
+    -------
+    path : `str`
+        Path to ``daf_butler_admin`` folder in the user cache directory,
+        which is ``$XDG_CACHE_HOME`` or ``~/.cache``.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "daf_butler_admin")
+
+
+def default_cache_file(name: str, repo: str) -> str:
+    """Return default location of a local cache file for one repository.
+
+    Parameters
+    ----------
+    name : `str`
+        Base name of the file.
+    repo : `str`
+        URI of butler repository.
+
+    Returns
+    -------
+    path : `str`
+        Path to the file in `default_cache_dir`, with a hash of repository
+        URI added to the file name before its extension.
+    """
+    stem, extension = os.path.splitext(name)
+    digest = hashlib.sha256(repo.encode()).hexdigest()[:16]
+    return os.path.join(default_cache_dir(), f"{stem}-{digest}{extension}")
+
+
+class CheckCache:
+    """Persistent cache of collection summary check results.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to SQLite database file, created if it does not exist.
+    repo : `str`
+        URI of butler repository, results for different repositories are
+        stored separately in the same file.
+
+    Notes
+    -----
+    Each cached result is stored together with a fingerprint of collection
+    contents, the result is only returned if fingerprint did not change.
+    New results are written immediately, each in its own short transaction,
+    times of last use of cached results are written when the context
+    manager exits. No transaction is kept open between updates, so several
+    processes can share the same file.
+    """
+
+    def __init__(self, path: str, repo: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._repo = repo
+        # Autocommit mode, transactions are only started explicitly.
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS summary_check ("
+            "repo TEXT NOT NULL, "
+            "collection TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, "
+            "summary_types TEXT NOT NULL, "
+            "dataset_types TEXT NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (repo, collection))"
+        )
+        self._used: set[str] = set()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        try:
+            self._write_used()
+        finally:
+            self._connection.close()
+
+    def get(self, collection: str, fingerprint: str) -> tuple[set[str], set[str]] | None:
+        """Return cached check result for a collection.
+
+        Parameters
+        ----------
+        collection : `str`
+            Name of the collection.
+        fingerprint : `str`
+            Current fingerprint of the collection.
+
+        Returns
+        -------
+        result : `tuple` [`set` [`str`], `set` [`str`]] or `None`
+            Names of dataset types in the summary and names of dataset types
+            in the collection. `None` is returned if there is no cached
+            result or if collection fingerprint has changed.
+        """
+        row = self._connection.execute(
+            "SELECT fingerprint, summary_types, dataset_types FROM summary_check "
+            "WHERE repo = ? AND collection = ?",
+            (self._repo, collection),
+        ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        self._used.add(collection)
+        return set(json.loads(row[1])), set(json.loads(row[2]))
+
+    def put(
+        self, collection: str, fingerprint: str, summary_types: set[str], dataset_types: set[str]
+    ) -> None:
+        """Store check result for a collection.
+
+        Parameters
+        ----------
+        collection : `str`
+            Name of the collection.
+        fingerprint : `str`
+            Fingerprint of the collection computed before the check.
+        summary_types : `set` [`str`]
+            Names of dataset types in the summary.
+        dataset_types : `set` [`str`]
+            Names of dataset types in the collection.
+        """
+        self._connection.execute(
+            "INSERT OR REPLACE INTO summary_check VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self._repo,
+                collection,
+                fingerprint,
+                json.dumps(sorted(summary_types)),
+                json.dumps(sorted(dataset_types)),
+                time.time(),
+            ),
+        )
+
+    def evict(self, max_age: float) -> int:
+        """Remove entries that were not used recently.
+
+        Parameters
+        ----------
+        max_age : `float`
+            Entries that were not used during this number of seconds are
+            removed, for all repositories.
+
+        Returns
+        -------
+        count : `int`
+            Number of removed entries.
+        """
+        self._write_used()
+        cursor = self._connection.execute(
+            "DELETE FROM summary_check WHERE last_used < ?", (time.time() - max_age,)
+        )
+        if cursor.rowcount:
+            _LOG.debug("Evicted %d entries from summary check cache.", cursor.rowcount)
+        return cursor.rowcount
+
+    def _write_used(self) -> None:
+        """Update time of last use of cached results in one transaction."""
+        if not self._used:
+            return
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany(
+                "UPDATE summary_check SET last_used = ? WHERE repo = ? AND collection = ?",
+                [(now, self._repo, collection) for collection in sorted(self._used)],
+            )
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        self._used = set()
@@ -0,0 +1,478 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Low-level access to collection summary and dataset association tables.
+
+There is no Butler or Registry interface for these operations, everything
+here has to be done using their internals.
+"""
+
+from __future__ import annotations
+
+__all__ = ["SummaryTables"]
+
+import concurrent.futures
+import json
+from collections.abc import Collection, Iterable, Iterator
+from typing import Any
+
+import astropy.time
+import sqlalchemy
+
+from lsst.daf.butler import CollectionType, DimensionGroup, ddl
+from lsst.daf.butler.direct_butler import DirectButler
+from lsst.daf.butler.registry.datasets.byDimensions import ByDimensionsDatasetRecordStorageManagerUUID
+from lsst.daf.butler.registry.interfaces import CollectionRecord, Database
+from lsst.daf.butler.registry.wildcards import CollectionWildcard
+from lsst.utils.iteration import chunk_iterable
+
+# Maximum number of collection keys in a single IN clause.
+_IN_CHUNK_SIZE = 1000
+
+
+class SummaryTables:
+    """Helper class for querying collection summary tables and the tables
+    that associate datasets with collections.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.direct_butler.DirectButler`
+        Data butler to query.
+    """
+
+    def __init__(self, butler: DirectButler):
+        # We need SqlRegistry.
+        registry = butler._registry
+        dataset_manager = registry._managers.datasets
+        assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+            "Unexpected type of dataset manager"
+        )
+        self._db = registry._db
+        self._collection_manager = registry._managers.collections
+        self._dataset_manager = dataset_manager
+        self.collection_key_name = self._collection_manager.getCollectionForeignKeyName()
+        self.summary_table = dataset_manager._summaries._tables.datasetType
+
+        # Load all dataset types, this also fills the caches used below.
+        dataset_types = dataset_manager._fetch_dataset_types()
+        self.dataset_type_names: dict[int, str] = {}
+        for dataset_type in dataset_types:
+            storage = dataset_manager._find_storage(dataset_type.name)
+            self.dataset_type_names[storage.dataset_type_id] = dataset_type.name
+
+        # Dataset types that share dimensions also share tags/calibs tables.
+        self.tags_tables: list[sqlalchemy.Table] = []
+        self.calibs_tables: list[sqlalchemy.Table] = []
+        tables_by_dimensions: dict[DimensionGroup, tuple[sqlalchemy.Table, sqlalchemy.Table | None]] = {}
+        for dimensions in dict.fromkeys(dataset_type.dimensions for dataset_type in dataset_types):
+            dynamic_tables = dataset_manager._get_dynamic_tables(dimensions)
+            tags_table = dataset_manager._get_tags_table(dynamic_tables)
+            calibs_table = None
+            self.tags_tables.append(tags_table)
+            if dynamic_tables.calibs_name is not None:
+                calibs_table = dataset_manager._get_calibs_table(dynamic_tables)
+                self.calibs_tables.append(calibs_table)
+            tables_by_dimensions[dimensions] = (tags_table, calibs_table)
+
+        # Mapping of dataset type ID to its tags and calibs tables.
+        self._tags_tables_by_id: dict[int, sqlalchemy.Table] = {}
+        self._calibs_tables_by_id: dict[int, sqlalchemy.Table] = {}
+        for dataset_type in dataset_types:
+            dataset_type_id = dataset_manager._find_storage(dataset_type.name).dataset_type_id
+            tags_table, calibs_table = tables_by_dimensions[dataset_type.dimensions]
+            self._tags_tables_by_id[dataset_type_id] = tags_table
+            if dataset_type.isCalibration() and calibs_table is not None:
+                self._calibs_tables_by_id[dataset_type_id] = calibs_table
+
+        self._all_collection_keys = {record.key for record in self.collections(CollectionType.all())}
+
+    def collections(
+        self, collection_types: Iterable[CollectionType], expression: Any = ...
+    ) -> list[CollectionRecord]:
+        """Return records for non-chained collections, sorted by name.
+
+        Parameters
+        ----------
+        collection_types : `~collections.abc.Iterable` [`CollectionType`]
+            Types of collections to return.
+        expression : `~typing.Any`, optional
+            Collection names or wildcard expression, by default all
+            collections are returned.
+
+        Returns
+        -------
+        records : `list` [`CollectionRecord`]
+            Collection records.
+        """
+        records = self._collection_manager.resolve_wildcard(
+            CollectionWildcard.from_expression(expression),
+            collection_types=frozenset(collection_types),
+            include_chains=False,
+        )
+        return sorted(records, key=lambda record: record.name)
+
+    def summary_contents(self, collections: Collection[CollectionRecord]) -> dict[Any, set[int]]:
+        """Return dataset type IDs stored in the summary table for each
+        collection.
+
+        Parameters
+        ----------
+        collections : `~collections.abc.Collection` [`CollectionRecord`]
+            Collections to query.
+
+        Returns
+        -------
+        contents : `dict` [`~typing.Any`, `set` [`int`]]
+            Mapping of collection key to the set of dataset type IDs.
+            Collections with empty summaries do not appear in the mapping.
+        """
+        collection_column = self.summary_table.columns[self.collection_key_name]
+        query = sqlalchemy.select(collection_column, self.summary_table.columns.dataset_type_id)
+        return self._fetch_pairs(query, collection_column, collections)
+
+    def dataset_contents(
+        self, collections: Collection[CollectionRecord], jobs: int = 1
+    ) -> dict[Any, set[int]]:
+        """Return IDs of dataset types that have at least one dataset in each
+        collection.
+
+        Parameters
+        ----------
+        collections : `~collections.abc.Collection` [`CollectionRecord`]
+            Collections to query.
+        jobs : `int`, optional
+            Number of tables to query in parallel, each parallel query uses
+            its own database connection.
+
+        Returns
+        -------
+        contents : `dict` [`~typing.Any`, `set` [`int`]]
+            Mapping of collection key to the set of dataset type IDs.
+            Collections without datasets do not appear in the mapping.
+
+        Notes
+        -----
+        This runs one aggregate query per tags or calibs table, the number of
+        queries does not depend on the number of datasets or collections.
+        """
+        tables = self.tags_tables + self.calibs_tables
+        contents: dict[Any, set[int]] = {}
+        if jobs > 1 and len(tables) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(
+                    executor.map(
+                        lambda table: self._table_contents(table, collections, self._db.clone()), tables
+                    )
+                )
+        else:
+            results = [self._table_contents(table, collections, self._db) for table in tables]
+        for table_contents in results:
+            for key, ids in table_contents.items():
+                contents.setdefault(key, set()).update(ids)
+        return contents
+
+    def _table_contents(
+        self, table: sqlalchemy.Table, collections: Collection[CollectionRecord], db: Database
+    ) -> dict[Any, set[int]]:
+        """Return IDs of dataset types in each collection from a single tags
+        or calibs table.
+        """
+        collection_column = table.columns[self.collection_key_name]
+        dataset_type_column = table.columns.dataset_type_id
+        query = sqlalchemy.select(collection_column, dataset_type_column).group_by(
+            collection_column, dataset_type_column
+        )
+        return self._fetch_pairs(query, collection_column, collections, db)
+
+    def probe_contents(self, collection: CollectionRecord, candidate_ids: Iterable[int]) -> set[int]:
+        """Return IDs of dataset types that have at least one dataset in a
+        collection using existence queries.
+
+        Parameters
+        ----------
+        collection : `CollectionRecord`
+            Collection to query.
+        candidate_ids : `~collections.abc.Iterable` [`int`]
+            IDs of dataset types that are expected to be in the collection,
+            usually from collection summary.
+
+        Returns
+        -------
+        dataset_type_ids : `set` [`int`]
+            IDs of dataset types with datasets in the collection.
+
+        Notes
+        -----
+        Each candidate dataset type is checked with a query that stops at the
+        first matching row. Other dataset types are checked with one similar
+        query per table, and only if that finds a row each of them is checked
+        individually. The cost of this does not depend on the number of
+        datasets in a collection.
+        """
+        if collection.type is CollectionType.CALIBRATION:
+            tables_by_id = self._calibs_tables_by_id
+        else:
+            tables_by_id = self._tags_tables_by_id
+        candidates = {dataset_type_id for dataset_type_id in candidate_ids if dataset_type_id in tables_by_id}
+
+        found: set[int] = set()
+        for dataset_type_id in sorted(candidates):
+            if self._exists(tables_by_id[dataset_type_id], collection, [dataset_type_id]):
+                found.add(dataset_type_id)
+
+        # Group remaining dataset types by table.
+        others: dict[str, tuple[sqlalchemy.Table, list[int]]] = {}
+        for dataset_type_id, table in tables_by_id.items():
+            if dataset_type_id not in candidates:
+                others.setdefault(table.name, (table, []))[1].append(dataset_type_id)
+        for table, dataset_type_ids in others.values():
+            if self._exists(table, collection, dataset_type_ids):
+                for dataset_type_id in sorted(dataset_type_ids):
+                    if self._exists(table, collection, [dataset_type_id]):
+                        found.add(dataset_type_id)
+        return found
+
+    def _exists(
+        self, table: sqlalchemy.Table, collection: CollectionRecord, dataset_type_ids: Collection[int]
+    ) -> bool:
+        """Check that a table has at least one dataset of given types in a
+        collection.
+        """
+        dataset_type_column = table.columns.dataset_type_id
+        if len(dataset_type_ids) == 1:
+            dataset_type_where = dataset_type_column == next(iter(dataset_type_ids))
+        else:
+            dataset_type_where = dataset_type_column.in_(sorted(dataset_type_ids))
+        query = (
+            sqlalchemy.select(sqlalchemy.literal(1))
+            .select_from(table)
+            .where(table.columns[self.collection_key_name] == collection.key, dataset_type_where)
+            .limit(1)
+        )
+        with self._db.query(query) as result:
+            return result.first() is not None
+
+    def refresh(self, collections: Collection[CollectionRecord], jobs: int = 1) -> int:
+        """Remove stale records for given collections from summary table.
+
+        Parameters
+        ----------
+        collections : `~collections.abc.Collection` [`CollectionRecord`]
+            Collections to refresh.
+        jobs : `int`, optional
+            Number of dataset tables to query in parallel.
+
+        Returns
+        -------
+        removed : `int`
+            Number of stale records removed from summary table.
+
+        Notes
+        -----
+        Same as ``Registry.refresh_collection_summaries``, this only removes
+        records for dataset types that no longer exist in a collection.
+        Missing records are not added, they would also need records in the
+        governor dimension summary tables, which regular clients always
+        write together with datasets.
+
+        Summary and dataset tables are read outside of transaction, only the
+        difference is applied in a single short transaction. Regular clients
+        only add to summary tables, to avoid deleting what concurrent
+        transactions may add, summary table is read before dataset tables,
+        and each stale record is checked again before it is deleted.
+        """
+        summary_contents = self.summary_contents(collections)
+        dataset_contents = self.dataset_contents(collections, jobs)
+        to_delete: list[tuple[CollectionRecord, int]] = []
+        for record in collections:
+            summary_ids = summary_contents.get(record.key, set())
+            dataset_ids = dataset_contents.get(record.key, set())
+            to_delete += [(record, dataset_type_id) for dataset_type_id in sorted(summary_ids - dataset_ids)]
+        if not to_delete:
+            return 0
+        removed = 0
+        with self._db.transaction():
+            # Datasets could have been added after dataset tables were read.
+            delete_rows = [
+                {self.collection_key_name: record.key, "dataset_type_id": dataset_type_id}
+                for record, dataset_type_id in to_delete
+                if not self._exists_any(record, dataset_type_id)
+            ]
+            for rows in chunk_iterable(delete_rows, _IN_CHUNK_SIZE):
+                removed += self._db.delete(
+                    self.summary_table, [self.collection_key_name, "dataset_type_id"], *rows
+                )
+        return removed
+
+    def _exists_any(self, collection: CollectionRecord, dataset_type_id: int) -> bool:
+        """Check that a collection has at least one dataset of given type in
+        the tags or calibs table.
+        """
+        if collection.type is CollectionType.CALIBRATION:
+            table = self._calibs_tables_by_id.get(dataset_type_id)
+        else:
+            table = self._tags_tables_by_id.get(dataset_type_id)
+        return table is not None and self._exists(table, collection, [dataset_type_id])
+
+    def modified_since(
+        self, collections: Iterable[CollectionRecord], since: astropy.time.Time
+    ) -> list[CollectionRecord]:
+        """Select collections that contain datasets ingested after given
+        time.
+
+        Parameters
+        ----------
+        collections : `~collections.abc.Iterable` [`CollectionRecord`]
+            Collections to select from.
+        since : `astropy.time.Time`
+            Datasets with ingest date later than this are selected.
+
+        Returns
+        -------
+        selected : `list` [`CollectionRecord`]
+            Selected collections, in the same order as ``collections``.
+        """
+        collections = list(collections)
+        dataset_table = self._dataset_manager._static.dataset
+        ingest_date = dataset_table.columns.ingest_date
+        if self._dataset_manager.ingest_date_dtype() is ddl.AstropyTimeNsecTai:
+            where = ingest_date > since
+        else:
+            # Older schema uses naive datetime in UTC.
+            where = ingest_date > since.utc.to_datetime()
+        keys: set[Any] = set()
+        for table in self.tags_tables + self.calibs_tables:
+            collection_column = table.columns[self.collection_key_name]
+            query = (
+                sqlalchemy.select(collection_column)
+                .select_from(table.join(dataset_table, table.columns.dataset_id == dataset_table.columns.id))
+                .where(where)
+                .distinct()
+            )
+            keys.update(row[0] for row in self._query_collections(query, collection_column, collections))
+        return [record for record in collections if record.key in keys]
+
+    def fingerprints(self, collections: Collection[CollectionRecord]) -> dict[Any, str]:
+        """Compute fingerprints of collection contents and summaries.
+
+        Parameters
+        ----------
+        collections : `~collections.abc.Collection` [`CollectionRecord`]
+            Collections to query.
+
+        Returns
+        -------
+        fingerprints : `dict` [`~typing.Any`, `str`]
+            Mapping of collection key to its fingerprint.
+
+        Notes
+        -----
+        Fingerprint combines the number of datasets in a collection, maximum
+        ingest date of its datasets, and the contents of its summary. For RUN
+        collections it is computed from the dataset table without joining
+        tags tables. Fingerprint changes when datasets are added to or
+        removed from a collection (except for the unlikely case when the
+        same number of older datasets are removed and added).
+        """
+        dataset_table = self._dataset_manager._static.dataset
+        ingest_date = dataset_table.columns.ingest_date
+        stats: dict[Any, tuple[int, Any]] = {}
+
+        run_collections = [record for record in collections if record.type is CollectionType.RUN]
+        if run_collections:
+            run_column = dataset_table.columns[self._collection_manager.getRunForeignKeyName()]
+            query = sqlalchemy.select(
+                run_column, sqlalchemy.func.count(), sqlalchemy.func.max(ingest_date)
+            ).group_by(run_column)
+            for key, count, max_date in self._query_collections(query, run_column, run_collections):
+                stats[key] = (count, max_date)
+
+        other_collections = [record for record in collections if record.type is not CollectionType.RUN]
+        if other_collections:
+            for table in self.tags_tables + self.calibs_tables:
+                collection_column = table.columns[self.collection_key_name]
+                query = (
+                    sqlalchemy.select(
+                        collection_column, sqlalchemy.func.count(), sqlalchemy.func.max(ingest_date)
+                    )
+                    .select_from(
+                        table.join(dataset_table, table.columns.dataset_id == dataset_table.columns.id)
+                    )
+                    .group_by(collection_column)
+                )
+                for key, count, max_date in self._query_collections(
+                    query, collection_column, other_collections
+                ):
+                    if key in stats:
+                        old_count, old_max_date = stats[key]
+                        count += old_count
+                        max_date = max(max_date, old_max_date)
+                    stats[key] = (count, max_date)
+
+        summary_contents = self.summary_contents(collections)
+        fingerprints: dict[Any, str] = {}
+        for record in collections:
+            count, max_date = stats.get(record.key, (0, None))
+            summary_ids = sorted(summary_contents.get(record.key, ()))
+            fingerprints[record.key] = json.dumps([str(record.key), count, str(max_date), summary_ids])
+        return fingerprints
+
+    def _fetch_pairs(
+        self,
+        query: sqlalchemy.Select,
+        collection_column: sqlalchemy.ColumnElement,
+        collections: Collection[CollectionRecord],
+        db: Database | None = None,
+    ) -> dict[Any, set[int]]:
+        """Run a query returning (collection key, dataset type ID) pairs and
+        group the result by collection.
+        """
+        pairs: dict[Any, set[int]] = {}
+        for key, dataset_type_id in self._query_collections(query, collection_column, collections, db):
+            pairs.setdefault(key, set()).add(dataset_type_id)
+        return pairs
+
+    def _query_collections(
+        self,
+        query: sqlalchemy.Select,
+        collection_column: sqlalchemy.ColumnElement,
+        collections: Collection[CollectionRecord],
+        db: Database | None = None,
+    ) -> Iterator[sqlalchemy.Row]:
+        """Run a query whose first column is collection key, restricting it
+        to given collections.
+        """
+        if db is None:
+            db = self._db
+        keys = {record.key for record in collections}
+        if keys >= self._all_collection_keys:
+            # No need to filter on collection if we want all of them.
+            queries = [query]
+        else:
+            queries = [
+                query.where(collection_column.in_(chunk))
+                for chunk in chunk_iterable(sorted(keys), _IN_CHUNK_SIZE)
+            ]
+        for chunk_query in queries:
+            with db.query(chunk_query) as result:
+                for row in result:
+                    if row[0] in keys:
+                        yield row
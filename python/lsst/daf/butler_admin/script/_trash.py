@@ -0,0 +1,660 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Low-level access to datastore trash tables.
+
+There is no Butler or Datastore interface for processing trash in parts,
+everything here has to be done using their internals.
+"""
+
+from __future__ import annotations
+
+__all__ = [
+    "REMOVED_FROM_REGISTRY",
+    "DatastoreTrash",
+    "TrashJournal",
+    "TrashLedger",
+    "dataset_origins",
+    "default_ledger_file",
+    "file_datastores",
+    "format_size",
+    "trash_statistics",
+]
+
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Collection, Iterator
+from types import TracebackType
+from typing import IO, Self
+
+import sqlalchemy
+
+from lsst.daf.butler import DatasetId
+from lsst.daf.butler.datastore import Datastore
+from lsst.daf.butler.datastore.stored_file_info import StoredFileInfo
+from lsst.daf.butler.datastores.chainedDatastore import ChainedDatastore
+from lsst.daf.butler.datastores.fileDatastore import FileDatastore
+from lsst.daf.butler.direct_butler import DirectButler
+from lsst.daf.butler.registry.bridge.monolithic import MonolithicDatastoreRegistryBridge
+from lsst.daf.butler.registry.datasets.byDimensions import ByDimensionsDatasetRecordStorageManagerUUID
+from lsst.daf.butler.registry.opaque import ByNameOpaqueTableStorage
+from lsst.resources import ResourcePath
+from lsst.utils.iteration import chunk_iterable
+
+from ._check_cache import default_cache_file
+
+_LOG = logging.getLogger(__name__)
+
+# Maximum number of parameters in one SQLite query.
+_SQLITE_CHUNK_SIZE = 500
+
+# Label used instead of run or dataset type of trashed datasets that were
+# removed from registry, datastore records do not have this information.
+REMOVED_FROM_REGISTRY = "<removed from registry>"
+
+
+def file_datastores(datastore: Datastore) -> list[FileDatastore]:
+    """Return all file datastores in a (possibly chained) datastore.
+
+    Parameters
+    ----------
+    datastore : `lsst.daf.butler.datastore.Datastore`
+        Datastore to search.
+
+    Returns
+    -------
+    datastores : `list` [`FileDatastore`]
+        File datastores, in the order of the chain.
+    """
+    if isinstance(datastore, FileDatastore):
+        return [datastore]
+    elif isinstance(datastore, ChainedDatastore):
+        return [child for datastore in datastore.datastores for child in file_datastores(datastore)]
+    return []
+
+
+def default_ledger_file(repo: str) -> str:
+    """Return default location of the trash ledger file for a repository.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+
+    Returns
+    -------
+    path : `str`
+        Path to the ledger file in the user cache directory, separate for
+        each repository.
+    """
+    return default_cache_file("trash_ledger.sqlite3", repo)
+
+
+def format_size(size: int) -> str:
+    """Format size in bytes as a human-readable string.
+
+    Parameters
+    ----------
+    size : `int`
+        Size in bytes.
+
+    Returns
+    -------
+    formatted : `str`
+        Size with binary unit suffix.
+    """
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if value < 1024 or unit == "TiB":
+            break
+        value /= 1024
+    return f"{size} B" if unit == "B" else f"{value:.1f} {unit}"
+
+
+def dataset_origins(
+    butler: DirectButler, dataset_ids: Collection[DatasetId]
+) -> dict[DatasetId, tuple[str, str]]:
+    """Return run and dataset type of trashed datasets that are still known
+    to registry.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.direct_butler.DirectButler`
+        Data butler.
+    dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+        IDs of trashed datasets.
+
+    Returns
+    -------
+    origins : `dict` [`DatasetId`, `tuple` [`str`, `str`]]
+        Mapping of dataset ID to the name of its run and dataset type.
+        Datasets that were removed from registry do not appear in the mapping.
+    """
+    registry = butler._registry
+    dataset_manager = registry._managers.datasets
+    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+        "Unexpected type of dataset manager"
+    )
+    collection_manager = registry._managers.collections
+    dataset_table = dataset_manager._static.dataset
+    dataset_type_table = dataset_manager._static.dataset_type
+    run_column = dataset_table.columns[collection_manager.getRunForeignKeyName()]
+    query = sqlalchemy.select(
+        dataset_table.columns.id, run_column, dataset_type_table.columns.name
+    ).select_from(
+        dataset_table.join(
+            dataset_type_table, dataset_table.columns.dataset_type_id == dataset_type_table.columns.id
+        )
+    )
+    rows: list[sqlalchemy.Row] = []
+    for chunk in chunk_iterable(sorted(dataset_ids), 1000):
+        with registry._db.query(query.where(dataset_table.columns.id.in_(chunk))) as result:
+            rows.extend(result)
+    # Collection lookup may need to run queries, so it is done after the
+    # query result is closed.
+    return {
+        dataset_id: (collection_manager[run_key].name, dataset_type_name)
+        for dataset_id, run_key, dataset_type_name in rows
+    }
+
+
+def trash_statistics(butler: DirectButler, trash: DatastoreTrash) -> dict[str, int]:
+    """Count trashed datasets by dataset type using one aggregate query.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.direct_butler.DirectButler`
+        Data butler.
+    trash : `DatastoreTrash`
+        Trash of the datastore.
+
+    Returns
+    -------
+    counts : `dict` [`str`, `int`]
+        Mapping of dataset type name to the number of trashed datasets.
+        Datasets that were removed from registry have no dataset type, they
+        are counted as `REMOVED_FROM_REGISTRY`.
+    """
+    registry = butler._registry
+    dataset_manager = registry._managers.datasets
+    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+        "Unexpected type of dataset manager"
+    )
+    dataset_table = dataset_manager._static.dataset
+    dataset_type_table = dataset_manager._static.dataset_type
+    dataset_type_name = sqlalchemy.func.coalesce(
+        dataset_type_table.columns.name, REMOVED_FROM_REGISTRY
+    ).label("name")
+    query = (
+        sqlalchemy.select(dataset_type_name, sqlalchemy.func.count())
+        .select_from(
+            trash.trash_table.outerjoin(
+                dataset_table, trash.trash_table.columns.dataset_id == dataset_table.columns.id
+            ).outerjoin(
+                dataset_type_table, dataset_table.columns.dataset_type_id == dataset_type_table.columns.id
+            )
+        )
+        .where(trash.trash_table.columns.datastore_name == trash.datastore_name)
+        .group_by(dataset_type_name)
+    )
+    with registry._db.query(query) as result:
+        return dict(result.tuples().all())
+
+
+class DatastoreTrash:
+    """Helper class for querying trash table of a single file datastore.
+
+    Parameters
+    ----------
+    datastore : `FileDatastore`
+        Datastore whose trash is processed.
+    """
+
+    def __init__(self, datastore: FileDatastore):
+        bridge = datastore.bridge
+        assert isinstance(bridge, MonolithicDatastoreRegistryBridge), "Unexpected type of datastore bridge"
+        self.datastore = datastore
+        self.name = datastore.name
+        self._db = bridge._db
+        self.datastore_name = bridge.datastoreName
+        self.trash_table = bridge._tables.dataset_location_trash
+        assert isinstance(datastore._table, ByNameOpaqueTableStorage), "Unexpected type of records table"
+        self.records_table = datastore._table._table
+
+    def batches(self, batch_size: int) -> Iterator[list[DatasetId]]:
+        """Iterate over dataset IDs in the trash table in batches.
+
+        Parameters
+        ----------
+        batch_size : `int`
+            Maximum number of dataset IDs in one batch.
+
+        Yields
+        ------
+        dataset_ids : `list` [`DatasetId`]
+            IDs of trashed datasets, ordered by ID.
+
+        Notes
+        -----
+        Each batch is fetched with a separate query that continues from the
+        last ID of the previous batch, so it does not matter whether the
+        previous batch was removed from the trash table or not. Only one
+        batch is kept in memory.
+        """
+        dataset_id_column = self.trash_table.columns.dataset_id
+        query = (
+            sqlalchemy.select(dataset_id_column)
+            .where(self.trash_table.columns.datastore_name == self.datastore_name)
+            .order_by(dataset_id_column)
+            .limit(batch_size)
+        )
+        last_id: DatasetId | None = None
+        while True:
+            batch_query = query if last_id is None else query.where(dataset_id_column > last_id)
+            with self._db.query(batch_query) as result:
+                dataset_ids = list(result.scalars())
+            if not dataset_ids:
+                return
+            yield dataset_ids
+            if len(dataset_ids) < batch_size:
+                return
+            last_id = dataset_ids[-1]
+
+    def record_totals(self) -> tuple[int, int]:
+        """Return number of datastore records of trashed datasets and their
+        total size, using one aggregate query.
+
+        Returns
+        -------
+        count : `int`
+            Number of datastore records.
+        size : `int`
+            Total size of artifacts in bytes, records without known size are
+            not included. Artifacts shared by several records are counted
+            more than once.
+        """
+        records_table = self.records_table
+        file_size = records_table.columns.file_size
+        query = (
+            sqlalchemy.select(
+                sqlalchemy.func.count(),
+                sqlalchemy.func.coalesce(
+                    sqlalchemy.func.sum(sqlalchemy.case((file_size > 0, file_size), else_=0)), 0
+                ),
+            )
+            .select_from(
+                records_table.join(
+                    self.trash_table,
+                    records_table.columns.dataset_id == self.trash_table.columns.dataset_id,
+                )
+            )
+            .where(self.trash_table.columns.datastore_name == self.datastore_name)
+        )
+        with self._db.query(query) as result:
+            count, size = result.one()
+        return count, int(size)
+
+    def count(self) -> int:
+        """Return number of datasets in the trash table.
+
+        Returns
+        -------
+        count : `int`
+            Number of trashed datasets of this datastore.
+        """
+        query = (
+            sqlalchemy.select(sqlalchemy.func.count())
+            .select_from(self.trash_table)
+            .where(self.trash_table.columns.datastore_name == self.datastore_name)
+        )
+        with self._db.query(query) as result:
+            return result.scalar_one()
+
+    def artifacts(self, dataset_ids: Collection[DatasetId]) -> dict[DatasetId, dict[ResourcePath, int]]:
+        """Return artifacts of trashed datasets.
+
+        Parameters
+        ----------
+        dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+            IDs of trashed datasets.
+
+        Returns
+        -------
+        artifacts : `dict` [`DatasetId`, `dict` [`ResourcePath`, `int`]]
+            Mapping of dataset ID to URIs of its artifacts, without fragments,
+            and their sizes from datastore records (negative if unknown).
+            Datasets without datastore records do not appear in the mapping.
+        """
+        artifacts: dict[DatasetId, dict[ResourcePath, int]] = {}
+        for row in self.datastore._table.fetch(dataset_id=list(dataset_ids)):
+            info = StoredFileInfo.from_record(row)
+            uri = info.file_location(self.datastore.locationFactory).uri.replace(fragment="")
+            artifacts.setdefault(row["dataset_id"], {})[uri] = info.file_size
+        return artifacts
+
+    def remove(self, dataset_ids: Collection[DatasetId]) -> None:
+        """Remove datasets from the trash table and their records from the
+        datastore records table.
+
+        Parameters
+        ----------
+        dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+            IDs of trashed datasets whose artifacts were removed.
+        """
+        if not dataset_ids:
+            return
+        with self._db.transaction():
+            self.datastore._table.delete(["dataset_id"], *[{"dataset_id": id} for id in dataset_ids])
+            self._db.delete(
+                self.trash_table,
+                ["dataset_id", "datastore_name"],
+                *[{"dataset_id": id, "datastore_name": self.datastore_name} for id in dataset_ids],
+            )
+
+
+class TrashLedger:
+    """Local record of the time when trashed datasets were first seen.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to SQLite database file, created if it does not exist.
+    repo : `str`
+        URI of butler repository, datasets from different repositories are
+        stored separately in the same file.
+
+    Notes
+    -----
+    Trash table does not record when datasets were trashed, this ledger
+    provides an approximation of that time if trash is checked regularly.
+    Instances of this class should be used as context managers, updates
+    are committed on exit.
+    """
+
+    def __init__(self, path: str, repo: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        """Path to SQLite database file (`str`)."""
+        self.created = not os.path.exists(path)
+        """`True` if ledger file did not exist before (`bool`)."""
+        self._repo = repo
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS trash_seen ("
+            "repo TEXT NOT NULL, "
+            "datastore TEXT NOT NULL, "
+            "dataset_id TEXT NOT NULL, "
+            "first_seen REAL NOT NULL, "
+            "last_seen REAL NOT NULL, "
+            "PRIMARY KEY (repo, datastore, dataset_id))"
+        )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self._connection.commit()
+        self._connection.close()
+
+    def first_seen(self, datastore: str, dataset_ids: Collection[DatasetId]) -> dict[DatasetId, float]:
+        """Return the time when trashed datasets were first seen, recording
+        datasets that were not seen before.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+        dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+            IDs of trashed datasets.
+
+        Returns
+        -------
+        first_seen : `dict` [`DatasetId`, `float`]
+            Mapping of dataset ID to POSIX time when it was first seen.
+        """
+        now = time.time()
+        ids = [str(dataset_id) for dataset_id in dataset_ids]
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO trash_seen VALUES (?, ?, ?, ?, ?)",
+            [(self._repo, datastore, id, now, now) for id in ids],
+        )
+        for chunk in chunk_iterable(ids, _SQLITE_CHUNK_SIZE):
+            placeholders = ", ".join("?" * len(chunk))
+            self._connection.execute(
+                "UPDATE trash_seen SET last_seen = ? "
+                f"WHERE repo = ? AND datastore = ? AND dataset_id IN ({placeholders})",
+                (now, self._repo, datastore, *chunk),
+            )
+        self._connection.commit()
+        return self.seen(datastore, dataset_ids)
+
+    def seen(self, datastore: str, dataset_ids: Collection[DatasetId]) -> dict[DatasetId, float]:
+        """Return the time when trashed datasets were first seen, without
+        recording datasets that were not seen before.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+        dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+            IDs of trashed datasets.
+
+        Returns
+        -------
+        first_seen : `dict` [`DatasetId`, `float`]
+            Mapping of dataset ID to POSIX time when it was first seen,
+            datasets that are not in the ledger do not appear in the mapping.
+        """
+        ids = {str(dataset_id): dataset_id for dataset_id in dataset_ids}
+        first_seen: dict[DatasetId, float] = {}
+        for chunk in chunk_iterable(list(ids), _SQLITE_CHUNK_SIZE):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._connection.execute(
+                "SELECT dataset_id, first_seen FROM trash_seen "
+                f"WHERE repo = ? AND datastore = ? AND dataset_id IN ({placeholders})",
+                (self._repo, datastore, *chunk),
+            )
+            first_seen.update((ids[id], seen) for id, seen in rows)
+        return first_seen
+
+    def forget(self, datastore: str, dataset_ids: Collection[DatasetId]) -> None:
+        """Remove datasets that are no longer in trash.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+        dataset_ids : `~collections.abc.Collection` [`DatasetId`]
+            IDs of datasets removed from trash.
+        """
+        self._connection.executemany(
+            "DELETE FROM trash_seen WHERE repo = ? AND datastore = ? AND dataset_id = ?",
+            [(self._repo, datastore, str(dataset_id)) for dataset_id in dataset_ids],
+        )
+        self._connection.commit()
+
+    def evict(self, max_age: float) -> int:
+        """Remove datasets that were not seen recently, e.g. because they
+        were removed from trash by other clients.
+
+        Parameters
+        ----------
+        max_age : `float`
+            Datasets that were not seen during this number of seconds are
+            removed, for all repositories.
+
+        Returns
+        -------
+        count : `int`
+            Number of removed entries.
+        """
+        cursor = self._connection.execute(
+            "DELETE FROM trash_seen WHERE last_seen < ?", (time.time() - max_age,)
+        )
+        if cursor.rowcount:
+            _LOG.debug("Evicted %d entries from trash ledger.", cursor.rowcount)
+        return cursor.rowcount
+
+
+class TrashJournal:
+    """Local journal of artifacts that were removed from datastore but whose
+    datasets may still be in the trash table.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the journal file.
+    repo : `str`
+        URI of butler repository, journal cannot be used with a different
+        repository.
+
+    Notes
+    -----
+    Each removed artifact is appended to the file immediately. When datasets
+    are removed from trash table, their artifacts are removed from the
+    journal, so the journal only contains artifacts of unfinished batches.
+    Instances of this class should be used as context managers, file is
+    only kept if processing was interrupted by an exception, or if the
+    process was killed.
+
+    Journal is locked by a process that uses it, with a separate lock file,
+    `RuntimeError` is raised if it is already used by another process.
+    """
+
+    def __init__(self, path: str, repo: str):
+        self._path = path
+        self._repo = repo
+        self._pending: dict[str, set[str]] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Journal file itself is replaced when it is updated, lock file is
+        # never replaced or removed.
+        self._lock: IO[str] = open(path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            raise RuntimeError(f"Journal file {path} is used by another process.") from None
+        try:
+            self._read()
+        except BaseException:
+            self._lock.close()
+            raise
+        self._file: IO[str] = open(path, "a")
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        try:
+            self._file.close()
+            # Artifacts that are left after successful run belong to datasets
+            # that were not finished for other reasons, next run will handle
+            # them anyway.
+            if exc_type is None or not any(self._pending.values()):
+                os.remove(self._path)
+        finally:
+            self._lock.close()
+
+    def __len__(self) -> int:
+        return sum(len(uris) for uris in self._pending.values())
+
+    def pending(self, datastore: str) -> set[ResourcePath]:
+        """Return artifacts that were recorded as removed, but whose
+        datasets may still be in trash.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+
+        Returns
+        -------
+        uris : `set` [`lsst.resources.ResourcePath`]
+            Artifacts removed from the datastore.
+        """
+        return {ResourcePath(uri) for uri in self._pending.get(datastore, ())}
+
+    def record(self, datastore: str, uri: ResourcePath) -> None:
+        """Record removed artifact.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+        uri : `lsst.resources.ResourcePath`
+            Removed artifact.
+        """
+        entry = {"repo": self._repo, "datastore": datastore, "uri": str(uri)}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._pending.setdefault(datastore, set()).add(str(uri))
+
+    def commit(self, datastore: str, uris: Collection[ResourcePath]) -> None:
+        """Remove artifacts whose datasets were removed from trash.
+
+        Parameters
+        ----------
+        datastore : `str`
+            Name of the datastore.
+        uris : `~collections.abc.Collection` [`lsst.resources.ResourcePath`]
+            Artifacts to remove from the journal.
+        """
+        self._pending.get(datastore, set()).difference_update(str(uri) for uri in uris)
+        # Rewrite the file with remaining entries, replacing it atomically.
+        self._file.close()
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as file:
+            for name, pending in self._pending.items():
+                for uri in sorted(pending):
+                    file.write(json.dumps({"repo": self._repo, "datastore": name, "uri": uri}) + "\n")
+        os.replace(tmp_path, self._path)
+        self._file = open(self._path, "a")
+
+    def _read(self) -> None:
+        """Read artifacts left in the journal by interrupted run."""
+        path = self._path
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line could be incomplete after a crash.
+                        continue
+                    if entry["repo"] != self._repo:
+                        raise ValueError(
+                            f"Journal file {path} was made for a different repository {entry['repo']}."
+                        )
+                    self._pending.setdefault(entry["datastore"], set()).add(entry["uri"])
@@ -0,0 +1,228 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+__all__ = ["batch"]
+
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any
+
+import yaml
+
+from .._profiling import phase
+from ._butler import shared_butler
+from .empty_trash import empty_trash
+from .refresh_collection_summary import refresh_collection_summary
+from .trash_stats import trash_stats
+from .update_storage_class import update_storage_class
+
+if TYPE_CHECKING:
+    import click
+
+# Commands that can be used in a batch, their options are converted by the
+# command line definitions of the same commands.
+_COMMANDS: dict[str, Callable[..., None]] = {
+    "empty-trash": empty_trash,
+    "refresh-collection-summary": refresh_collection_summary,
+    "trash-stats": trash_stats,
+    "update-storage-class": update_storage_class,
+}
+
+
+def batch(plan: str, repo: str | None = None) -> None:
+    """Run a sequence of admin commands with one butler.
+
+    Parameters
+    ----------
+    plan : `str`
+        Name of YAML file with the plan. It contains ``repo`` key with the
+        URI of butler repository, and ``steps`` key with the list of
+        commands. Each command is a mapping with a single key, the name of
+        command, and a mapping of its options, using the same names as
+        command line options. Option values are converted and validated in
+        the same way as on command line, options that can be specified
+        multiple times accept a list or a single value.
+    repo : `str`, optional
+        URI of butler repository, overrides ``repo`` in the plan.
+
+    Notes
+    -----
+    All commands use the same butler instance and database connection.
+    Commands run in order, processing stops at the first failed command.
+    """
+    with open(plan) as file:
+        contents = yaml.safe_load(file)
+    if not isinstance(contents, dict):
+        raise ValueError(f"Plan {plan} must be a mapping with repo and steps keys.")
+    repo = repo or contents.get("repo")
+    if not repo:
+        raise ValueError(f"Plan {plan} does not define repository.")
+    steps = [_parse_step(index, step, repo) for index, step in enumerate(contents.get("steps") or [], 1)]
+    if not steps:
+        raise ValueError(f"Plan {plan} does not define any steps.")
+
+    timings: list[tuple[str, float]] = []
+    with shared_butler(repo):
+        for index, (name, function, kwargs) in enumerate(steps, 1):
+            print(f"Step {index}/{len(steps)}: {name}")
+            start = time.monotonic()
+            try:
+                with phase(name):
+                    function(repo, **kwargs)
+            except Exception as exc:
+                elapsed = time.monotonic() - start
+                print(f"Step {index}/{len(steps)}: {name} failed after {elapsed:.2f} s: {exc}")
+                if (skipped := len(steps) - index) > 0:
+                    print(f"Skipped {skipped} remaining step{'' if skipped == 1 else 's'}.")
+                raise
+            elapsed = time.monotonic() - start
+            timings.append((name, elapsed))
+            print(f"Step {index}/{len(steps)}: {name} finished in {elapsed:.2f} s")
+
+    print("Summary:")
+    for index, (name, elapsed) in enumerate(timings, 1):
+        print(f"  {index}. {name}: {elapsed:.2f} s")
+    print(f"  Total: {sum(elapsed for _, elapsed in timings):.2f} s")
+
+
+def _parse_step(index: int, step: Any, repo: str) -> tuple[str, Callable[..., None], dict[str, Any]]:
+    """Convert plan step into script function and its arguments.
+
+    Parameters
+    ----------
+    index : `int`
+        Step number, used in error messages.
+    step : `typing.Any`
+        Step from the plan, mapping with a single key.
+    repo : `str`
+        URI of butler repository.
+
+    Returns
+    -------
+    name : `str`
+        Command name.
+    function : `~collections.abc.Callable`
+        Script function.
+    kwargs : `dict` [`str`, `typing.Any`]
+        Keyword arguments of the script function, without repository.
+    """
+    import click
+
+    # Commands are defined by command line layer, import it only when
+    # needed.
+    from ..cli.cmd import admin
+
+    if isinstance(step, str):
+        step = {step: {}}
+    if not isinstance(step, dict) or len(step) != 1:
+        raise ValueError(f"Step {index} must be a command name or a mapping with a single command name.")
+    ((name, options),) = step.items()
+    if name not in _COMMANDS:
+        raise ValueError(f"Step {index} has unknown command {name!r}, known: {', '.join(sorted(_COMMANDS))}.")
+    if not isinstance(options, dict | None):
+        raise ValueError(f"Options of step {index} must be a mapping.")
+    command = admin.commands[name]
+    args = _command_args(index, name, command, repo, options or {})
+    try:
+        with command.make_context(name, args) as ctx:
+            kwargs = dict(ctx.params)
+    except click.ClickException as exc:
+        raise ValueError(
+            f"Step {index} has invalid options for command {name}: {exc.format_message()}"
+        ) from None
+    del kwargs["repo"]
+    return name, _COMMANDS[name], kwargs
+
+
+def _command_args(
+    index: int, name: str, command: click.Command, repo: str, options: dict[str, Any]
+) -> list[str]:
+    """Convert options of a plan step into command line arguments.
+
+    Parameters
+    ----------
+    index : `int`
+        Step number, used in error messages.
+    name : `str`
+        Command name.
+    command : `click.Command`
+        Command line definition of the command.
+    repo : `str`
+        URI of butler repository.
+    options : `dict` [`str`, `typing.Any`]
+        Options of the step.
+
+    Returns
+    -------
+    args : `list` [`str`]
+        Command line arguments, options are followed by positional
+        arguments.
+    """
+    import click
+
+    params = {param.name: param for param in command.params}
+    args: list[str] = []
+    arguments: dict[str, list[str]] = {"repo": [repo]}
+    for key, value in options.items():
+        param = params.get(key.replace("-", "_"))
+        if param is None or param.name == "repo":
+            raise ValueError(f"Step {index} has unknown option {key!r} for command {name}.")
+        if value is None:
+            continue
+        if isinstance(value, list):
+            if not param.multiple and param.nargs == 1:
+                raise ValueError(f"Option {key!r} of step {index} only accepts a single value.")
+            values = [str(item) for item in value]
+        elif isinstance(value, dict):
+            raise ValueError(f"Option {key!r} of step {index} must be a value or a list of values.")
+        else:
+            values = [str(value)]
+        if isinstance(param, click.Argument):
+            arguments[param.name] = values
+        elif isinstance(param, click.Option) and param.is_flag:
+            if not isinstance(value, bool):
+                raise ValueError(f"Option {key!r} of step {index} must be true or false.")
+            if value:
+                args.append(max(param.opts, key=len))
+            elif param.secondary_opts:
+                args.append(max(param.secondary_opts, key=len))
+        else:
+            option = max(param.opts, key=len)
+            for item in values:
+                args += [option, item]
+    # Positional arguments cannot be skipped, only trailing ones can be
+    # omitted.
+    positional: list[str] = []
+    missing: str | None = None
+    for param in command.params:
+        if isinstance(param, click.Argument):
+            if param.name not in arguments:
+                missing = missing or param.name
+            elif missing is not None:
+                raise ValueError(
+                    f"Option {param.name!r} of step {index} requires option {missing!r} for command {name}."
+                )
+            else:
+                positional += arguments[param.name]
+    return [*args, "--", *positional]
@@ -24,14 +24,96 @@ from __future__ import annotations
 __all__ = ["empty_trash"]
 
 
+import concurrent.futures
+import contextlib
+import dataclasses
 import logging
+import re
+import time
+from collections.abc import Callable, Iterable
+from typing import TextIO
 
-from lsst.daf.butler import Butler
+from lsst.daf.butler import DatasetId
+from lsst.daf.butler.direct_butler import DirectButler
+from lsst.resources import ResourcePath
+
+from .._profiling import phase
+from ._butler import open_butler
+from ._check_cache import default_cache_file
+from ._trash import (
+    REMOVED_FROM_REGISTRY,
+    DatastoreTrash,
+    TrashJournal,
+    TrashLedger,
+    dataset_origins,
+    default_ledger_file,
+    file_datastores,
+    format_size,
+)
 
 _LOG = logging.getLogger(__name__)
 
+# Batch size used for parallel removal if it is not specified.
+_DEFAULT_BATCH_SIZE = 10_000
+
+# Number of attempts to remove each artifact and delay before first retry,
+# delay doubles for each following retry.
+_MAX_ATTEMPTS = 3
+_RETRY_DELAY = 0.5
+
+# Ledger entries for datasets not seen during this time are removed.
+_LEDGER_MAX_AGE = 30 * 24 * 3600
+
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 24 * 3600, "w": 7 * 24 * 3600}
+
+
+@dataclasses.dataclass
+class _Budget:
+    """Limits for a single run of trash emptying."""
+
+    deadline: float | None = None
+    """Value of `time.monotonic` after which no artifacts are removed."""
+
+    max_artifacts: int | None = None
+    """Maximum number of artifacts to remove."""
+
+    n_removed: int = 0
+    """Number of artifacts removed so far."""
+
+    def remaining(self) -> int | None:
+        """Return number of artifacts that can still be removed, `None` if
+        not limited.
+        """
+        if self.max_artifacts is None:
+            return None
+        return max(self.max_artifacts - self.n_removed, 0)
+
+    def exceeded(self) -> str | None:
+        """Return description of the exceeded limit, `None` if no limit was
+        reached.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "time limit"
+        if self.remaining() == 0:
+            return "artifact limit"
+        return None
 
-def empty_trash(repo: str, verbose: bool, dry_run: bool) -> None:
+
+def empty_trash(
+    repo: str,
+    verbose: bool,
+    dry_run: bool,
+    batch_size: int | None = None,
+    jobs: int = 1,
+    max_seconds: float | None = None,
+    max_artifacts: int | None = None,
+    older_than: str | None = None,
+    sort: bool = False,
+    log_file: str | None = None,
+    resume: bool = False,
+    journal_file: str | None = None,
+    ledger_file: str | None = None,
+) -> None:
     """Empty the datastore trash table.
 
     Parameters
@@ -39,20 +121,566 @@ def empty_trash(repo: str, verbose: bool, dry_run: bool) -> None:
     repo : `str`
         URI of butler repository to update.
     verbose : `bool`
-        If `True` report the datasets that were removed.
+        If `True` report URIs of the artifacts that were removed. URIs are
+        printed after each batch is processed, unless ``sort`` is `True`.
     dry_run : `bool`
         If `True` report how many datasets would be removed but do not
-        remove them.
+        remove them. The report includes total size of the artifacts that
+        would be removed, broken down by run, dataset type, and top-level
+        folder in the datastore. Run and dataset type of datasets that were
+        removed from registry are not known.
+    batch_size : `int`, optional
+        If specified then trash is processed in batches of this number of
+        datasets, each batch is committed in a separate transaction.
+        Otherwise whole trash is processed in one operation, unless any of
+        the options below are used.
+    jobs : `int`, optional
+        Number of threads used to remove artifacts, or to find sizes of
+        artifacts that are not in datastore records in dry-run mode. Removal
+        of each artifact is retried on errors, datasets whose artifacts could
+        not be removed are left in trash.
+    max_seconds : `float`, optional
+        Stop removing artifacts after this number of seconds.
+    max_artifacts : `int`, optional
+        Stop after removing this number of artifacts.
+    older_than : `str`, optional
+        Only remove datasets that were in trash for at least this time,
+        a number with optional unit suffix (s, m, h, d, w), e.g. "7d".
+        Trash table does not record the time when datasets were trashed,
+        instead a local ledger file records when each dataset was first seen
+        in trash by this script. Datasets that were not seen before are never
+        removed, so the ledger has to be kept between runs.
+    sort : `bool`, optional
+        If `True` then URIs of removed artifacts are sorted and reported when
+        processing finishes, this needs memory for all URIs.
+    log_file : `str`, optional
+        Name of the file to write URIs of removed artifacts to, one URI per
+        line, instead of printing them. Implies ``verbose``.
+    resume : `bool`, optional
+        If `True` then continue a run that was interrupted. Artifacts that
+        were recorded in the journal as removed are not removed again, their
+        datasets are removed from trash.
+    journal_file : `str`, optional
+        Path to the journal of removed artifacts, by default a file in the
+        user cache directory is used, separate for each repository. Journal
+        is only kept while there are removed artifacts whose datasets are
+        still in trash, it is only written when trash is processed in
+        batches. Only one process can use the journal at a time.
+    ledger_file : `str`, optional
+        Path to the ledger of trashed datasets used with ``older_than``, by
+        default a file in the user cache directory is used, separate for each
+        repository.
     """
+    age = _parse_age(older_than) if older_than is not None else None
+    budget = _Budget(
+        deadline=time.monotonic() + max_seconds if max_seconds is not None else None,
+        max_artifacts=max_artifacts,
+    )
+    streaming = (verbose and not sort) or log_file is not None
     # Connect to the butler.
-    with Butler.from_config(repo, writeable=True) as butler:
+    with (
+        open_butler(repo) as butler,
+        open(log_file, "w") if log_file is not None else contextlib.nullcontext() as file,
+    ):
+        writer = _RemovedWriter(file, sort) if verbose or file is not None else None
+        if (
+            batch_size is None
+            and jobs == 1
+            and max_seconds is None
+            and max_artifacts is None
+            and age is None
+            and not streaming
+            and not dry_run
+            and not resume
+        ):
+            try:
+                with phase("empty trash"):
+                    removed = butler._datastore.emptyTrash(dry_run=dry_run)
+            except AttributeError:
+                print("Butler repository does not have a datastore that can support trash emptying")
+                return
+            if writer is not None:
+                writer.write(removed)
+        else:
+            assert isinstance(butler, DirectButler), "This script requires DirectButler."
+            datastores = file_datastores(butler._datastore)
+            if not datastores:
+                print("Butler repository does not have a datastore that can support trash emptying")
+                return
+            with (
+                TrashLedger(ledger_file or default_ledger_file(repo), repo)
+                if age is not None
+                else contextlib.nullcontext() as ledger,
+                TrashJournal(journal_file or _default_journal_file(repo), repo)
+                if not dry_run
+                else contextlib.nullcontext() as journal,
+            ):
+                if journal is not None and len(journal) and not resume:
+                    raise ValueError(
+                        f"Journal has {len(journal)} artifacts removed by interrupted run, "
+                        "use resume option to finish it."
+                    )
+                if ledger is not None and ledger.created:
+                    _LOG.warning(
+                        "Created new trash ledger %s, datasets are first seen in trash now and none of "
+                        "them can be removed by this run. Keep the ledger file for the following runs.",
+                        ledger.path,
+                    )
+                for datastore in datastores:
+                    trash = DatastoreTrash(datastore)
+                    space = _SpaceReport(butler, trash, jobs) if dry_run else None
+                    result = _empty_trash_batches(
+                        trash,
+                        batch_size or _DEFAULT_BATCH_SIZE,
+                        dry_run,
+                        writer,
+                        jobs,
+                        budget,
+                        ledger,
+                        age,
+                        space,
+                        journal,
+                    )
+                    if space is not None:
+                        space.print()
+                    _report(trash, result, older_than)
+                    if result.stopped is not None:
+                        break
+                if ledger is not None:
+                    ledger.evict(_LEDGER_MAX_AGE)
+        if writer is not None:
+            writer.close()
+
+
+class _RemovedWriter:
+    """Writer for URIs of removed artifacts.
+
+    Parameters
+    ----------
+    file : `typing.TextIO` or `None`
+        File to write URIs to, if `None` then URIs are printed to standard
+        output after a header line.
+    sort : `bool`
+        If `True` then URIs are collected and written sorted when writer is
+        closed, otherwise they are written immediately.
+    """
+
+    def __init__(self, file: TextIO | None, sort: bool):
+        self._file = file
+        self._sort = sort
+        self._collected: set[ResourcePath] = set()
+        self._header_printed = False
+
+    def write(self, uris: Iterable[ResourcePath]) -> None:
+        """Write or collect URIs of removed artifacts.
+
+        Parameters
+        ----------
+        uris : `~collections.abc.Iterable` [`lsst.resources.ResourcePath`]
+            URIs of removed artifacts.
+        """
+        if self._sort:
+            self._collected.update(uris)
+        else:
+            self._write(uris)
+
+    def close(self) -> None:
+        """Write collected URIs."""
+        if self._collected:
+            self._write(sorted(self._collected))
+            self._collected = set()
+
+    def _write(self, uris: Iterable[ResourcePath]) -> None:
+        for uri in uris:
+            if self._file is None and not self._header_printed:
+                print("Removed the following:")
+                self._header_printed = True
+            print(uri, file=self._file)
+        if self._file is not None:
+            self._file.flush()
+
+
+def _default_journal_file(repo: str) -> str:
+    """Return default location of the journal file for a repository."""
+    return default_cache_file("empty_trash_journal.jsonl", repo)
+
+
+def _parse_age(value: str) -> float:
+    """Convert age string to seconds.
+
+    Parameters
+    ----------
+    value : `str`
+        Number with optional unit suffix (s, m, h, d, w).
+
+    Returns
+    -------
+    seconds : `float`
+        Age in seconds.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([smhdw]?)\s*", value)
+    if match is None:
+        raise ValueError(f"Cannot parse age string {value!r}, expect number with optional unit (s/m/h/d/w)")
+    return float(match.group(1)) * _AGE_UNITS[match.group(2)]
+
+
+class _SpaceReport:
+    """Report of the space that can be reclaimed by emptying trash.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.direct_butler.DirectButler`
+        Data butler.
+    trash : `DatastoreTrash`
+        Trash of the datastore.
+    jobs : `int`
+        Number of threads used to find sizes of artifacts that are not
+        known to datastore records.
+    """
+
+    def __init__(self, butler: DirectButler, trash: DatastoreTrash, jobs: int):
+        self._butler = butler
+        self._trash = trash
+        self._jobs = jobs
+        self._by_run: dict[str, list[int]] = {}
+        self._by_dataset_type: dict[str, list[int]] = {}
+        self._by_root: dict[str, list[int]] = {}
+        self._total = [0, 0]
+        self._unattributed = [0, 0]
+        self._n_missing = 0
+
+    def add(self, artifacts: set[ResourcePath], dataset_ids: list[DatasetId]) -> None:
+        """Add artifacts to the report.
+
+        Parameters
+        ----------
+        artifacts : `set` [`lsst.resources.ResourcePath`]
+            Artifacts that would be removed.
+        dataset_ids : `list` [`DatasetId`]
+            IDs of trashed datasets that own these artifacts.
+        """
+        origins = dataset_origins(self._butler, dataset_ids)
+        # Artifacts come from datastore records, each one has an owner.
+        sizes: dict[ResourcePath, int] = {}
+        owners: dict[ResourcePath, DatasetId] = {}
+        for dataset_id, dataset_artifacts in self._trash.artifacts(dataset_ids).items():
+            for uri, size in dataset_artifacts.items():
+                if uri in artifacts and uri not in owners:
+                    sizes[uri] = size
+                    owners[uri] = dataset_id
+        # Sizes that are not in records have to be found from storage.
+        unknown = [uri for uri in artifacts if sizes.get(uri, -1) < 0]
+        if unknown:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._jobs) as executor:
+                sizes.update(zip(unknown, executor.map(_artifact_size, unknown)))
+        for uri in artifacts:
+            size = sizes[uri]
+            if size < 0:
+                self._n_missing += 1
+                continue
+            if (origin := origins.get(owners[uri])) is None:
+                self._unattributed[0] += 1
+                self._unattributed[1] += size
+            run, dataset_type = origin or (REMOVED_FROM_REGISTRY, REMOVED_FROM_REGISTRY)
+            for totals, key in (
+                (self._by_run, run),
+                (self._by_dataset_type, dataset_type),
+                (self._by_root, self._storage_root(uri)),
+            ):
+                counts = totals.setdefault(key, [0, 0])
+                counts[0] += 1
+                counts[1] += size
+            self._total[0] += 1
+            self._total[1] += size
+
+    def print(self) -> None:
+        """Print the report."""
+        count, size = self._total
+        print(
+            f"Reclaimable space in datastore {self._trash.name}: "
+            f"{count} file artifact{'' if count == 1 else 's'}, {format_size(size)}."
+        )
+        if self._n_missing:
+            print(f"{self._n_missing} file artifact{'' if self._n_missing == 1 else 's'} do not exist.")
+        count, size = self._unattributed
+        if count:
+            print(
+                f"{count} file artifact{'' if count == 1 else 's'}, {format_size(size)}, belong to datasets "
+                "removed from registry, their run and dataset type cannot be determined."
+            )
+        for title, totals in (
+            ("run", self._by_run),
+            ("dataset type", self._by_dataset_type),
+            ("storage root", self._by_root),
+        ):
+            if totals:
+                print(f"By {title}:")
+                for key, (count, size) in sorted(totals.items(), key=lambda item: (-item[1][1], item[0])):
+                    print(f"  {key}: {count} file artifact{'' if count == 1 else 's'}, {format_size(size)}")
+
+    def _storage_root(self, uri: ResourcePath) -> str:
+        """Return top-level folder of an artifact in datastore."""
+        root = self._trash.datastore.root
+        relative = uri.relative_to(root)
+        if relative is None:
+            return str(uri.root_uri())
+        top, _, _ = relative.partition("/")
+        return str(root.join(top, forceDirectory=True))
+
+
+def _artifact_size(uri: ResourcePath) -> int:
+    """Return size of an artifact, negative if it does not exist."""
+    try:
+        return uri.size()
+    except FileNotFoundError:
+        return -1
+
+
+@dataclasses.dataclass
+class _TrashResult:
+    """Result of emptying trash of a single datastore."""
+
+    n_datasets: int = 0
+    """Number of trashed datasets that were processed."""
+
+    n_removed: int = 0
+    """Number of removed artifacts."""
+
+    n_failed: int = 0
+    """Number of artifacts that could not be removed."""
+
+    n_recent: int = 0
+    """Number of datasets skipped because they are too recent."""
+
+    stopped: str | None = None
+    """Description of the limit that stopped processing."""
+
+
+def _empty_trash_batches(
+    trash: DatastoreTrash,
+    batch_size: int,
+    dry_run: bool,
+    writer: _RemovedWriter | None,
+    jobs: int,
+    budget: _Budget,
+    ledger: TrashLedger | None,
+    age: float | None,
+    space: _SpaceReport | None = None,
+    journal: TrashJournal | None = None,
+) -> _TrashResult:
+    """Empty trash of a single datastore in batches.
+
+    Parameters
+    ----------
+    trash : `DatastoreTrash`
+        Trash of the datastore.
+    batch_size : `int`
+        Number of datasets in one batch.
+    dry_run : `bool`
+        If `True` do not remove anything.
+    writer : `_RemovedWriter` or `None`
+        Writer for URIs of removed artifacts, called after each batch.
+    jobs : `int`
+        Number of threads used to remove artifacts.
+    budget : `_Budget`
+        Limits for this run, shared by all datastores.
+    ledger : `TrashLedger` or `None`
+        Ledger of trashed datasets, only used with ``age``.
+    age : `float` or `None`
+        Minimum time in seconds since dataset was first seen in trash.
+    space : `_SpaceReport`, optional
+        Report of reclaimable space, updated in dry-run mode.
+    journal : `TrashJournal`, optional
+        Journal of removed artifacts, artifacts in the journal are not
+        removed again.
+
+    Returns
+    -------
+    result : `_TrashResult`
+        Summary of the processed trash.
+    """
+    result = _TrashResult()
+    journaled = journal.pending(trash.name) if journal is not None else set()
+    if journaled:
+        _LOG.info("Resuming with %d artifacts already removed from datastore %s.", len(journaled), trash.name)
+    for n_batches, dataset_ids in enumerate(trash.batches(batch_size), start=1):
+        result.stopped = budget.exceeded()
+        if result.stopped is not None:
+            break
+        if ledger is not None and age is not None:
+            first_seen = ledger.first_seen(trash.name, dataset_ids)
+            cutoff = time.time() - age
+            old_ids = [dataset_id for dataset_id in dataset_ids if first_seen[dataset_id] <= cutoff]
+            result.n_recent += len(dataset_ids) - len(old_ids)
+            dataset_ids = old_ids
+            if not dataset_ids:
+                continue
+
+        # Datastore decides which artifacts can be removed, this excludes
+        # artifacts shared with datasets that are not in trash.
+        with phase("select artifacts"):
+            candidates = trash.datastore._empty_trash_subset(selected_ids=dataset_ids, dry_run=True)
+        to_remove = candidates
+        if (remaining := budget.remaining()) is not None and len(to_remove) > remaining:
+            to_remove = set(sorted(to_remove)[:remaining])
+        if dry_run:
+            batch_removed = to_remove
+            if space is not None:
+                with phase("space report"):
+                    space.add(to_remove, dataset_ids)
+        else:
+            # Artifacts removed by interrupted run do not need to be removed.
+            resumed = to_remove & journaled
+            with phase("remove artifacts"):
+                failed, skipped = _remove_artifacts(
+                    to_remove - resumed,
+                    jobs,
+                    budget.deadline,
+                    (lambda uri: journal.record(trash.name, uri)) if journal is not None else None,
+                )
+            batch_removed = to_remove - failed - skipped
+            result.n_failed += len(failed)
+            # Only datasets whose artifacts are gone are removed from trash,
+            # each batch is committed separately, interrupting the process
+            # does not lose the batches that were already finished.
+            pending = candidates - batch_removed
+            with phase("update trash"):
+                artifacts = trash.artifacts(dataset_ids)
+                done_ids = [dataset_id for dataset_id, uris in artifacts.items() if pending.isdisjoint(uris)]
+                trash.remove(done_ids)
+            if ledger is not None:
+                ledger.forget(trash.name, done_ids)
+            if journal is not None:
+                done_uris = {uri for dataset_id in done_ids for uri in artifacts[dataset_id]}
+                journal.commit(trash.name, done_uris & batch_removed)
+                journaled -= done_uris
+        result.n_datasets += len(dataset_ids)
+        result.n_removed += len(batch_removed)
+        budget.n_removed += len(batch_removed)
+        if writer is not None:
+            writer.write(sorted(batch_removed))
+        _LOG.info(
+            "Batch %d: processed %d trashed datasets, %s %d file artifacts so far.",
+            n_batches,
+            result.n_datasets,
+            "would have removed" if dry_run else "removed",
+            result.n_removed,
+        )
+        result.stopped = budget.exceeded()
+        if result.stopped is not None:
+            break
+    _LOG.info(
+        "%sRemoved %d file artifact%s from datastore %s",
+        "Would have " if dry_run else "",
+        result.n_removed,
+        "s" if result.n_removed != 1 else "",
+        trash.name,
+    )
+    return result
+
+
+def _report(trash: DatastoreTrash, result: _TrashResult, older_than: str | None) -> None:
+    """Report what was left in trash.
+
+    Parameters
+    ----------
+    trash : `DatastoreTrash`
+        Trash of the datastore.
+    result : `_TrashResult`
+        Summary of the processed trash.
+    older_than : `str` or `None`
+        Minimum age of processed datasets.
+    """
+    if result.n_failed:
+        print(
+            f"Failed to remove {result.n_failed} file artifact{'' if result.n_failed == 1 else 's'}, "
+            "their datasets were left in trash."
+        )
+    if result.n_recent:
+        print(
+            f"Skipped {result.n_recent} trashed dataset{'' if result.n_recent == 1 else 's'} "
+            f"in datastore {trash.name} that were first seen less than {older_than} ago."
+        )
+    if result.stopped is not None:
+        left = trash.count()
+        print(
+            f"Stopped after reaching {result.stopped}, {left} trashed dataset{'' if left == 1 else 's'} "
+            f"left in datastore {trash.name}."
+        )
+
+
+def _remove_artifacts(
+    artifacts: set[ResourcePath],
+    jobs: int,
+    deadline: float | None = None,
+    on_removed: Callable[[ResourcePath], None] | None = None,
+) -> tuple[set[ResourcePath], set[ResourcePath]]:
+    """Remove artifacts using a pool of threads.
+
+    Parameters
+    ----------
+    artifacts : `set` [`lsst.resources.ResourcePath`]
+        Artifacts to remove.
+    jobs : `int`
+        Number of threads.
+    deadline : `float`, optional
+        Value of `time.monotonic` after which removal is not started.
+    on_removed : `~collections.abc.Callable`, optional
+        Function called with each removed artifact as soon as it is removed.
+
+    Returns
+    -------
+    failed : `set` [`lsst.resources.ResourcePath`]
+        Artifacts that could not be removed.
+    skipped : `set` [`lsst.resources.ResourcePath`]
+        Artifacts that were not removed because deadline has passed.
+    """
+    failed: set[ResourcePath] = set()
+    skipped: set[ResourcePath] = set()
+
+    def remove(uri: ResourcePath) -> Exception | None | bool:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        return _remove_artifact(uri)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(remove, uri): uri for uri in artifacts}
+        for future in concurrent.futures.as_completed(futures):
+            uri, outcome = futures[future], future.result()
+            if outcome is False:
+                skipped.add(uri)
+            elif isinstance(outcome, Exception):
+                _LOG.warning("Failed to remove file artifact %s: %s", uri, outcome)
+                failed.add(uri)
+            elif on_removed is not None:
+                on_removed(uri)
+    return failed, skipped
+
+
+def _remove_artifact(uri: ResourcePath) -> Exception | None:
+    """Remove single artifact, retrying on errors.
+
+    Parameters
+    ----------
+    uri : `lsst.resources.ResourcePath`
+        Artifact to remove.
+
+    Returns
+    -------
+    exception : `Exception` or `None`
+        Exception raised by the last attempt, `None` if artifact was removed
+        or did not exist.
+    """
+    for attempt in range(_MAX_ATTEMPTS):
         try:
-            removed = butler._datastore.emptyTrash(dry_run=dry_run)
-        except AttributeError:
-            print("Butler repository does not have a datastore that can support trash emptying")
-            return
-
-    if verbose and removed:
-        print("Removed the following:")
-        for uri in sorted(removed):
-            print(uri)
+            uri.remove()
+            return None
+        except FileNotFoundError:
+            # Some other process could have removed it.
+            return None
+        except Exception as exc:
+            if attempt + 1 == _MAX_ATTEMPTS:
+                return exc
+            _LOG.debug("Failed to remove file artifact %s, will retry: %s", uri, exc)
+            time.sleep(_RETRY_DELAY * 2**attempt)
+    return None
@@ -0,0 +1,182 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+__all__ = ["fanout"]
+
+import concurrent.futures
+import contextlib
+import dataclasses
+import io
+import logging
+import multiprocessing
+import time
+from collections.abc import Sequence
+
+# Placeholder for repository URI in command arguments.
+_REPO_PLACEHOLDER = "{repo}"
+
+# Format of log messages in command output, same as butler command line.
+_LOG_FORMAT = "{levelname} {name}: {message}"
+
+
+@dataclasses.dataclass
+class _RepoResult:
+    """Result of running a command on one repository."""
+
+    repo: str
+    """URI of butler repository."""
+
+    ok: bool
+    """`True` if command succeeded."""
+
+    elapsed: float
+    """Wall time of the command in seconds."""
+
+    output: str
+    """Standard output and error of the command."""
+
+    error: str | None = None
+    """Error message if command failed."""
+
+
+def fanout(repos: str, jobs: int, command: str, args: Sequence[str]) -> int:
+    """Run admin command on many repositories in parallel processes.
+
+    Parameters
+    ----------
+    repos : `str`
+        Name of the file with URIs of butler repositories, one per line.
+        Empty lines and lines starting with ``#`` are ignored.
+    jobs : `int`
+        Maximum number of commands running at the same time.
+    command : `str`
+        Name of the admin command.
+    args : `~collections.abc.Sequence` [`str`]
+        Command arguments without repository. Repository URI replaces
+        ``{repo}`` placeholder in arguments, if there is no placeholder it
+        is inserted as the first argument.
+
+    Returns
+    -------
+    failures : `int`
+        Number of repositories where command failed.
+
+    Notes
+    -----
+    Output of each command is printed when the command finishes, followed by
+    a summary of all commands. Each command runs in a separate process with
+    its own butler. Default journal, ledger and cache files of commands are
+    separate for each repository, so commands running at the same time do
+    not share them. Files given explicitly in ``args`` are shared.
+    """
+    if command == "fanout":
+        raise ValueError("Fanout command cannot run itself.")
+    with open(repos) as file:
+        uris = [line.strip() for line in file if line.strip() and not line.lstrip().startswith("#")]
+    if not uris:
+        raise ValueError(f"File {repos} does not contain any repositories.")
+
+    results: list[_RepoResult] = []
+    start = time.monotonic()
+    # Spawned processes do not inherit database connections or threads.
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(jobs, len(uris)), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [executor.submit(_run_command, uri, command, _command_args(uri, args)) for uri in uris]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = "OK" if result.ok else f"FAILED: {result.error}"
+            print(f"=== {result.repo} [{len(results)}/{len(uris)}] {status} ({result.elapsed:.2f} s)")
+            if result.output:
+                print(result.output, end="" if result.output.endswith("\n") else "\n", flush=True)
+    elapsed = time.monotonic() - start
+
+    failed = [result.repo for result in results if not result.ok]
+    print(
+        f"Summary: {command} on {len(uris)} repositories, {len(uris) - len(failed)} succeeded, "
+        f"{len(failed)} failed, total time {elapsed:.2f} s, longest "
+        f"{max(result.elapsed for result in results):.2f} s."
+    )
+    for repo in sorted(failed):
+        print(f"  Failed: {repo}")
+    return len(failed)
+
+
+def _command_args(repo: str, args: Sequence[str]) -> list[str]:
+    """Insert repository URI into command arguments."""
+    if any(_REPO_PLACEHOLDER in arg for arg in args):
+        return [arg.replace(_REPO_PLACEHOLDER, repo) for arg in args]
+    return [repo, *args]
+
+
+def _run_command(repo: str, command: str, args: list[str]) -> _RepoResult:
+    """Run admin command in a worker process.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+    command : `str`
+        Name of the admin command.
+    args : `list` [`str`]
+        Command arguments, including repository.
+
+    Returns
+    -------
+    result : `_RepoResult`
+        Result of the command.
+    """
+    import click
+
+    # Commands are defined by command line layer, import it in the worker
+    # process only.
+    from ..cli.cmd import admin
+
+    output = io.StringIO()
+    error: str | None = None
+    start = time.monotonic()
+    # Commands report some results with INFO messages, butler command line
+    # shows them but spawned process has no logging configuration. Worker
+    # process is reused for other repositories, handler is removed after
+    # each command.
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(logging.Formatter(_LOG_FORMAT, style="{"))
+    root_logger = logging.getLogger()
+    root_level = root_logger.level
+    root_logger.addHandler(handler)
+    root_logger.setLevel(logging.INFO)
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            exit_code = admin.main([command, *args], prog_name="butler admin", standalone_mode=False)
+            if isinstance(exit_code, int) and exit_code != 0:
+                error = f"exit code {exit_code}"
+        except click.ClickException as exc:
+            error = exc.format_message()
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        finally:
+            root_logger.removeHandler(handler)
+            root_logger.setLevel(root_level)
+    return _RepoResult(repo, error is None, time.monotonic() - start, output.getvalue(), error)
@@ -23,15 +23,100 @@ from __future__ import annotations
 
 __all__ = ["refresh_collection_summary"]
 
+import contextlib
+import dataclasses
+import json
 import logging
-from collections.abc import Iterable
+import os
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TextIO
+
+import astropy.time
 
 from lsst.daf.butler import Butler, CollectionType
+from lsst.daf.butler.direct_butler import DirectButler
+from lsst.daf.butler.registry import Registry
+from lsst.daf.butler.registry.interfaces import CollectionRecord
+from lsst.utils.iteration import chunk_iterable
+
+from .._profiling import phase
+from ._butler import open_butler
+from ._check_cache import CheckCache, default_cache_file
+from ._summaries import SummaryTables
 
 _LOG = logging.getLogger(__name__)
 
+# Cached check results that were not used for this time (in seconds) are
+# removed from cache.
+_CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+@dataclasses.dataclass
+class _CollectionCheck:
+    """Result of comparing collection summary with collection contents."""
+
+    name: str
+    """Name of the collection."""
+
+    type: CollectionType
+    """Type of the collection."""
+
+    summary_types: set[str]
+    """Names of dataset types in the collection summary."""
+
+    dataset_types: set[str]
+    """Names of dataset types of the datasets in the collection."""
 
-def refresh_collection_summary(repo: str, update: bool, tagged: bool) -> None:
+    elapsed: float | None = 0.0
+    """Time in seconds spent checking this collection, `None` if collection
+    was checked by queries shared by all collections."""
+
+    cached: bool = False
+    """`True` if result was taken from cache of previous checks."""
+
+    rechecked: bool = False
+    """`True` if collection was checked again after first check found
+    inconsistency."""
+
+    @property
+    def extra(self) -> set[str]:
+        """Dataset types that are in the summary but not in the collection
+        (`set` [`str`]).
+        """
+        return self.summary_types - self.dataset_types
+
+    @property
+    def missing(self) -> set[str]:
+        """Dataset types that are in the collection but not in the summary
+        (`set` [`str`]).
+        """
+        return self.dataset_types - self.summary_types
+
+    @property
+    def consistent(self) -> bool:
+        """`True` if summary matches collection contents (`bool`)."""
+        return self.summary_types == self.dataset_types
+
+
+def refresh_collection_summary(
+    repo: str,
+    update: bool,
+    tagged: bool,
+    method: str = "aggregate",
+    jobs: int = 1,
+    chunk_size: int | None = None,
+    checkpoint: str | None = None,
+    collections: Iterable[str] = (),
+    since: str | None = None,
+    cache_file: str | None = None,
+    ignore_cache: bool = False,
+    format: str = "text",
+    output: str | None = None,
+    recheck: bool = True,
+) -> None:
     """Refresh contents of the collection summary tables.
 
     Parameters
@@ -39,47 +124,592 @@ def refresh_collection_summary(repo: str, update: bool, tagged: bool) -> None:
     repo : `str`
         URI of butler repository to update.
     update : `bool`
-        Perform actual updates if `True`, print actions otherwise.
+        Perform actual updates if `True`, print actions otherwise. Update
+        removes summary records for dataset types that no longer exist in a
+        collection, missing records are reported by the check but are not
+        added.
     tagged : `bool`
         Only check tagged collections, ignored if ``update`` is `True`.
+    method : `str`, optional
+        Method used to check summaries when ``update`` is `False`, one of
+        "aggregate" (default), "probe", or "query". The "aggregate" method
+        runs one aggregate query per dataset tags/calibs table, "probe" runs
+        existence queries for each collection and dataset type, "query" uses
+        registry dataset queries for each collection which is much slower.
+    jobs : `int`, optional
+        Number of parallel workers, each worker uses its own database
+        connection. Used by the "query" method, and by ``update`` to query
+        dataset tables in parallel, in which case only the difference is
+        written to summary table in a short final transaction.
+    chunk_size : `int`, optional
+        If specified then ``update`` refreshes summaries for this number of
+        collections in a separate transaction, instead of updating everything
+        in one long transaction.
+    checkpoint : `str`, optional
+        Path to a checkpoint file for chunked update, requires
+        ``chunk_size``. The file is updated after each chunk and removed
+        when update finishes. If the file exists when update starts then
+        collections processed by the previous run are skipped.
+    collections : `~collections.abc.Iterable` [`str`], optional
+        Names or glob patterns of collections to check or update, by default
+        all collections are processed.
+    since : `str`, optional
+        If specified, only check or update collections that contain datasets
+        ingested after this time, in ISO format.
+    cache_file : `str`, optional
+        Path to the file with cached check results, by default a file in
+        the user cache directory is used, separate for each repository.
+        Results for collections whose contents did not change since previous
+        check are taken from cache. Cache is not used by the "aggregate"
+        method, which is as fast as finding which collections have changed.
+    ignore_cache : `bool`, optional
+        If `True` then check all collections, ignoring cached results. Cache
+        is still updated with new results. A warning is logged if this or
+        ``cache_file`` is given with the "aggregate" method.
+    format : `str`, optional
+        Format of the check report, "text" (default) prints a human-readable
+        message for each collection, "jsonl" prints one JSON object per
+        line for each collection, including names of extra and missing
+        dataset types. Each record is written as soon as the collection is
+        checked.
+    output : `str`, optional
+        Name of the file for the check report, by default report is printed
+        to standard output.
+    recheck : `bool`, optional
+        If `True` (default) then collections found to be inconsistent are
+        checked again, to reduce false alarms caused by concurrent updates.
     """
+    if checkpoint is not None and chunk_size is None:
+        raise ValueError("Checkpoint file can only be used with chunked update.")
+    if method not in ("aggregate", "probe", "query"):
+        raise ValueError(f"Unknown summary check method: {method}")
+    if format not in ("text", "jsonl"):
+        raise ValueError(f"Unknown output format: {format}")
+    expression = list(collections) or ...
+    since_time = _parse_time(since) if since is not None else None
     # Connect to the butler.
-    with Butler.from_config(repo, writeable=True) as butler:
-        registry = butler.registry
+    with open_butler(repo) as butler:
         if update:
-            registry.refresh_collection_summaries()
+            with phase("select collections"):
+                tables, records = _select_collections(butler, CollectionType.all(), expression, since_time)
+            with phase("refresh"):
+                _chunked_refresh(tables, records, repo, chunk_size or max(len(records), 1), checkpoint, jobs)
         else:
             # There are no registry methods to compare summaries with actual
-            # contents, use brute force by scanning all collections (this takes
-            # long time). Note that it could result in false alarms due to
-            # possible concurrent updates.
+            # contents, we have to scan all collections (this can take long
+            # time). Concurrent updates could result in false alarms, so
+            # inconsistent collections are checked again.
             collection_types: Iterable[CollectionType] = (
                 [CollectionType.TAGGED] if tagged else CollectionType.all()
             )
-            collections = sorted(
-                registry.queryCollections(collectionTypes=collection_types, includeChains=False)
-            )
-            for collection in collections:
-                collection_type = registry.getCollectionType(collection)
-                summary = registry.getCollectionSummary(collection)
-                summary_types = set(summary.dataset_types.names)
-                dataset_types = {
-                    ref.datasetType.name for ref in registry.queryDatasets(..., collections=collection)
-                }
-                diff = summary_types - dataset_types
-                if diff:
-                    print(
-                        f"Summary for {collection_type.name} collection {collection} "
-                        f"contains {len(diff)} extra dataset types."
-                    )
-                diff = dataset_types - summary_types
-                if diff:
-                    print(
-                        f"Summary for {collection_type.name} collection {collection} "
-                        f"contains {len(diff)} missing dataset types."
-                    )
-                if dataset_types == summary_types:
-                    print(
-                        f"Summary for {collection_type.name} collection {collection} is consistent "
-                        f"with {len(dataset_types)} dataset types."
-                    )
+            with phase("select collections"):
+                tables, records = _select_collections(butler, collection_types, expression, since_time)
+            write = _print_check if format == "text" else _write_jsonl
+
+            def run_checks(to_check: list[CollectionRecord]) -> Iterator[_CollectionCheck]:
+                return _run_checks(butler, repo, tables, to_check, method, jobs, recheck)
+
+            # Computing fingerprints costs about as much as the aggregate
+            # check itself, cache is only useful for slower methods.
+            if method == "aggregate" and (cache_file is not None or ignore_cache):
+                _LOG.warning("Check cache is not used by the aggregate method, cache options are ignored.")
+            with (
+                CheckCache(cache_file or _default_cache_file(repo), repo)
+                if method != "aggregate"
+                else contextlib.nullcontext() as cache,
+                open(output, "w") if output is not None else contextlib.nullcontext() as file,
+            ):
+                checks = (
+                    _cached_checks(tables, records, cache, ignore_cache, run_checks)
+                    if cache is not None
+                    else run_checks(records)
+                )
+                with phase("check"):
+                    for check in checks:
+                        write(check, file)
+                if cache is not None:
+                    cache.evict(_CACHE_MAX_AGE)
+
+
+def _parse_time(value: str) -> astropy.time.Time:
+    """Convert string in ISO format to astropy time.
+
+    Parameters
+    ----------
+    value : `str`
+        Time string, assumed to be in UTC.
+
+    Returns
+    -------
+    time : `astropy.time.Time`
+        Converted time.
+    """
+    try:
+        return astropy.time.Time(value, scale="utc")
+    except ValueError:
+        raise ValueError(f"Cannot parse time string {value!r}") from None
+
+
+def _default_cache_file(repo: str) -> str:
+    """Return default location of the check cache file for a repository."""
+    return default_cache_file("summary_check.sqlite3", repo)
+
+
+def _select_collections(
+    butler: Butler,
+    collection_types: Iterable[CollectionType],
+    expression: Any,
+    since: astropy.time.Time | None,
+) -> tuple[SummaryTables, list[CollectionRecord]]:
+    """Select collections to process.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Data butler, has to be an instance of `DirectButler`.
+    collection_types : `~collections.abc.Iterable` [`CollectionType`]
+        Types of collections to select.
+    expression : `~typing.Any`
+        Collection names or wildcard expression.
+    since : `astropy.time.Time` or `None`
+        If not `None` select only collections with datasets ingested after
+        this time.
+
+    Returns
+    -------
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    records : `list` [`CollectionRecord`]
+        Selected collections, ordered by name.
+    """
+    assert isinstance(butler, DirectButler), "This script requires DirectButler."
+    tables = SummaryTables(butler)
+    records = tables.collections(collection_types, expression)
+    if since is not None:
+        records = tables.modified_since(records, since)
+    return tables, records
+
+
+def _run_checks(
+    butler: Butler,
+    repo: str,
+    tables: SummaryTables,
+    collections: list[CollectionRecord],
+    method: str,
+    jobs: int,
+    recheck: bool = False,
+) -> Iterator[_CollectionCheck]:
+    """Check collection summaries using specified method.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Data butler to check.
+    repo : `str`
+        URI of butler repository.
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections to check.
+    method : `str`
+        Name of the check method.
+    jobs : `int`
+        Number of parallel workers for the "query" method.
+    recheck : `bool`, optional
+        If `True` then check inconsistent collections again.
+
+    Returns
+    -------
+    checks : `~collections.abc.Iterator` [`_CollectionCheck`]
+        Result of the check for each collection, in the same order as
+        ``collections``.
+    """
+    checks: Iterator[_CollectionCheck]
+    if method == "aggregate":
+        checks = _aggregate_checks(tables, collections)
+    elif method == "probe":
+        checks = _probe_checks(tables, collections)
+    else:
+        names = [record.name for record in collections]
+        if jobs > 1:
+            checks = _parallel_query_checks(repo, names, jobs)
+        else:
+            checks = (_query_check(butler.registry, collection) for collection in names)
+    if recheck:
+        checks = _rechecked(tables, collections, checks)
+    return checks
+
+
+def _rechecked(
+    tables: SummaryTables, collections: list[CollectionRecord], checks: Iterator[_CollectionCheck]
+) -> Iterator[_CollectionCheck]:
+    """Check again collections that were found to be inconsistent.
+
+    Parameters
+    ----------
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections that are checked.
+    checks : `~collections.abc.Iterator` [`_CollectionCheck`]
+        Results of the first check.
+
+    Yields
+    ------
+    check : `_CollectionCheck`
+        Result of the first check for consistent collections, result of the
+        second check for inconsistent collections.
+
+    Notes
+    -----
+    Summary and dataset tables are not read at the same time, datasets
+    added or removed by concurrent transactions in between can make the
+    summary look inconsistent. Second check reads both again for a single
+    collection, which makes such a coincidence much less likely but does
+    not exclude it, e.g. for a collection that is being written to during
+    the whole check. Second check uses existence queries, its cost does not
+    depend on the number of datasets in a collection.
+    """
+    records = {record.name: record for record in collections}
+    for check in checks:
+        if not check.consistent:
+            record = records[check.name]
+            _LOG.info("Checking collection %s again.", check.name)
+            (second_check,) = _probe_checks(tables, [record])
+            second_check.elapsed = (second_check.elapsed or 0.0) + (check.elapsed or 0.0)
+            second_check.rechecked = True
+            check = second_check
+            if check.consistent:
+                _LOG.info(
+                    "Summary for collection %s is consistent on second check, first check was "
+                    "affected by concurrent update.",
+                    check.name,
+                )
+        yield check
+
+
+def _cached_checks(
+    tables: SummaryTables,
+    collections: list[CollectionRecord],
+    cache: CheckCache,
+    ignore_cache: bool,
+    run_checks: Callable[[list[CollectionRecord]], Iterator[_CollectionCheck]],
+) -> Iterator[_CollectionCheck]:
+    """Check collection summaries, re-using cached results for collections
+    that did not change since previous check.
+
+    Parameters
+    ----------
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections to check.
+    cache : `CheckCache`
+        Cache of check results.
+    ignore_cache : `bool`
+        If `True` do not use cached results.
+    run_checks : `~collections.abc.Callable`
+        Function that checks a list of collections, returning results in the
+        same order.
+
+    Yields
+    ------
+    check : `_CollectionCheck`
+        Result of the check for each collection, in the same order as
+        ``collections``.
+    """
+    # Fingerprints are computed before checking, if collection changes during
+    # the check then its fingerprint will be different next time.
+    fingerprints = tables.fingerprints(collections)
+    cached: dict[str, _CollectionCheck] = {}
+    if not ignore_cache:
+        for record in collections:
+            if (result := cache.get(record.name, fingerprints[record.key])) is not None:
+                cached[record.name] = _CollectionCheck(record.name, record.type, *result, cached=True)
+    _LOG.info("Using cached check results for %d out of %d collections.", len(cached), len(collections))
+
+    new_checks = run_checks([record for record in collections if record.name not in cached])
+    for record in collections:
+        if (check := cached.get(record.name)) is None:
+            check = next(new_checks)
+            cache.put(record.name, fingerprints[record.key], check.summary_types, check.dataset_types)
+        yield check
+
+
+def _query_check(registry: Registry, collection: str) -> _CollectionCheck:
+    """Check collection summary using brute force by querying all datasets
+    in a collection.
+
+    Parameters
+    ----------
+    registry : `lsst.daf.butler.registry.Registry`
+        Registry to check.
+    collection : `str`
+        Name of the collection.
+
+    Returns
+    -------
+    check : `_CollectionCheck`
+        Result of the check.
+    """
+    start = time.monotonic()
+    collection_type = registry.getCollectionType(collection)
+    summary = registry.getCollectionSummary(collection)
+    dataset_types = {ref.datasetType.name for ref in registry.queryDatasets(..., collections=collection)}
+    return _CollectionCheck(
+        collection,
+        collection_type,
+        set(summary.dataset_types.names),
+        dataset_types,
+        elapsed=time.monotonic() - start,
+    )
+
+
+def _parallel_query_checks(repo: str, collections: list[str], jobs: int) -> Iterator[_CollectionCheck]:
+    """Check collection summaries using brute force in a pool of worker
+    threads.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+    collections : `list` [`str`]
+        Names of the collections to check.
+    jobs : `int`
+        Number of worker threads.
+
+    Yields
+    ------
+    check : `_CollectionCheck`
+        Result of the check for each collection, in the same order as
+        ``collections``.
+    """
+    # Each worker thread makes its own butler, so that it has a separate
+    # database connection.
+    local = threading.local()
+    butlers: list[Butler] = []
+    lock = threading.Lock()
+
+    def check(collection: str) -> _CollectionCheck:
+        butler = getattr(local, "butler", None)
+        if butler is None:
+            butler = Butler.from_config(repo)
+            local.butler = butler
+            with lock:
+                butlers.append(butler)
+        return _query_check(butler.registry, collection)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # Executor.map returns results in the order of its input.
+            yield from executor.map(check, collections)
+    finally:
+        for butler in butlers:
+            butler.close()
+
+
+def _aggregate_checks(
+    tables: SummaryTables, collections: list[CollectionRecord]
+) -> Iterator[_CollectionCheck]:
+    """Check collection summaries using aggregate queries on dataset tables.
+
+    Parameters
+    ----------
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections to check.
+
+    Yields
+    ------
+    check : `_CollectionCheck`
+        Result of the check for each collection, in the same order as
+        ``collections``.
+
+    Notes
+    -----
+    Summary table is read before dataset tables, so that datasets added
+    concurrently can only appear as missing from summaries.
+    """
+    summary_contents = tables.summary_contents(collections)
+    dataset_contents = tables.dataset_contents(collections)
+    names = tables.dataset_type_names
+    for record in collections:
+        yield _CollectionCheck(
+            record.name,
+            record.type,
+            {names[dataset_type_id] for dataset_type_id in summary_contents.get(record.key, ())},
+            {names[dataset_type_id] for dataset_type_id in dataset_contents.get(record.key, ())},
+            elapsed=None,
+        )
+
+
+def _probe_checks(tables: SummaryTables, collections: list[CollectionRecord]) -> Iterator[_CollectionCheck]:
+    """Check collection summaries using existence queries for each dataset
+    type in each collection.
+
+    Parameters
+    ----------
+    tables : `SummaryTables`
+        Helper object for querying summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections to check.
+
+    Yields
+    ------
+    check : `_CollectionCheck`
+        Result of the check for each collection, in the same order as
+        ``collections``.
+    """
+    summary_contents = tables.summary_contents(collections)
+    names = tables.dataset_type_names
+    for record in collections:
+        start = time.monotonic()
+        summary_ids = summary_contents.get(record.key, set())
+        dataset_ids = tables.probe_contents(record, summary_ids)
+        yield _CollectionCheck(
+            record.name,
+            record.type,
+            {names[dataset_type_id] for dataset_type_id in summary_ids},
+            {names[dataset_type_id] for dataset_type_id in dataset_ids},
+            elapsed=time.monotonic() - start,
+        )
+
+
+def _chunked_refresh(
+    tables: SummaryTables,
+    collections: list[CollectionRecord],
+    repo: str,
+    chunk_size: int,
+    checkpoint: str | None,
+    jobs: int = 1,
+) -> None:
+    """Refresh collection summaries in chunks of collections, each chunk is
+    updated in a separate transaction.
+
+    Parameters
+    ----------
+    tables : `SummaryTables`
+        Helper object for querying and updating summary tables.
+    collections : `list` [`CollectionRecord`]
+        Collections to update, ordered by name.
+    repo : `str`
+        URI of butler repository, saved in checkpoint file.
+    chunk_size : `int`
+        Number of collections to update in one transaction.
+    checkpoint : `str` or `None`
+        Path to a checkpoint file.
+    jobs : `int`, optional
+        Number of dataset tables to query in parallel.
+    """
+    # Collections are processed in the order of their names, checkpoint only
+    # needs to remember the last processed name.
+    if checkpoint is not None and (last_collection := _read_checkpoint(checkpoint, repo)) is not None:
+        collections = [record for record in collections if record.name > last_collection]
+        _LOG.info(
+            "Resuming from checkpoint %s, %d collections left to process.", checkpoint, len(collections)
+        )
+
+    total_removed, count = 0, 0
+    for chunk in chunk_iterable(collections, chunk_size):
+        total_removed += tables.refresh(chunk, jobs)
+        count += len(chunk)
+        if checkpoint is not None:
+            _write_checkpoint(checkpoint, repo, chunk[-1].name)
+        _LOG.info("Refreshed summaries for %d out of %d collections.", count, len(collections))
+
+    print(f"Removed {total_removed} stale collection summary record{'' if total_removed == 1 else 's'}.")
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def _read_checkpoint(checkpoint: str, repo: str) -> str | None:
+    """Read checkpoint file.
+
+    Parameters
+    ----------
+    checkpoint : `str`
+        Path to a checkpoint file.
+    repo : `str`
+        URI of butler repository, has to match the repository in checkpoint.
+
+    Returns
+    -------
+    last_collection : `str` or `None`
+        Name of the last collection processed, `None` if checkpoint file
+        does not exist.
+    """
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint) as file:
+        data = json.load(file)
+    if data["repo"] != repo:
+        raise ValueError(f"Checkpoint file {checkpoint} was made for a different repository {data['repo']}")
+    return data["last_collection"]
+
+
+def _write_checkpoint(checkpoint: str, repo: str, last_collection: str) -> None:
+    """Atomically replace contents of a checkpoint file.
+
+    Parameters
+    ----------
+    checkpoint : `str`
+        Path to a checkpoint file.
+    repo : `str`
+        URI of butler repository.
+    last_collection : `str`
+        Name of the last collection processed.
+    """
+    tmp_path = f"{checkpoint}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"repo": repo, "last_collection": last_collection}, file)
+    os.replace(tmp_path, checkpoint)
+
+
+def _print_check(check: _CollectionCheck, file: TextIO | None = None) -> None:
+    """Print the result of a collection summary check.
+
+    Parameters
+    ----------
+    check : `_CollectionCheck`
+        Result of the check.
+    file : `typing.TextIO`, optional
+        Output stream, `sys.stdout` is used by default.
+    """
+    prefix = f"Summary for {check.type.name} collection {check.name}"
+    if extra := check.extra:
+        print(f"{prefix} contains {len(extra)} extra dataset types.", file=file)
+    if missing := check.missing:
+        print(f"{prefix} contains {len(missing)} missing dataset types.", file=file)
+    if check.consistent:
+        print(f"{prefix} is consistent with {len(check.dataset_types)} dataset types.", file=file)
+
+
+def _write_jsonl(check: _CollectionCheck, file: TextIO | None = None) -> None:
+    """Write the result of a collection summary check as a single line of
+    JSON.
+
+    Check time is not written for collections checked by shared aggregate
+    queries, it is not known for individual collections.
+
+    Parameters
+    ----------
+    check : `_CollectionCheck`
+        Result of the check.
+    file : `typing.TextIO`, optional
+        Output stream, `sys.stdout` is used by default.
+    """
+    record = {
+        "collection": check.name,
+        "type": check.type.name,
+        "consistent": check.consistent,
+        "summary_dataset_types": len(check.summary_types),
+        "dataset_types": len(check.dataset_types),
+        "extra": sorted(check.extra),
+        "missing": sorted(check.missing),
+        "cached": check.cached,
+        "rechecked": check.rechecked,
+    }
+    if check.elapsed is not None:
+        record["elapsed"] = round(check.elapsed, 6)
+    print(json.dumps(record), file=file, flush=True)
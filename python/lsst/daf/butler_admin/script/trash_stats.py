@@ -0,0 +1,164 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+__all__ = ["trash_stats"]
+
+import contextlib
+import logging
+import os
+import time
+
+from lsst.daf.butler.direct_butler import DirectButler
+
+from .._profiling import phase
+from ._butler import open_butler
+from ._trash import (
+    REMOVED_FROM_REGISTRY,
+    DatastoreTrash,
+    TrashLedger,
+    default_ledger_file,
+    file_datastores,
+    format_size,
+    trash_statistics,
+)
+
+_LOG = logging.getLogger(__name__)
+
+_DAY = 24 * 3600
+
+# Labels and upper limits of the buckets of time in trash.
+_AGE_BUCKETS = (
+    ("< 1 day", _DAY),
+    ("1-7 days", 7 * _DAY),
+    ("7-30 days", 30 * _DAY),
+    ("30-365 days", 365 * _DAY),
+    ("> 1 year", float("inf")),
+)
+
+# Label of the bucket for datasets that were never seen by empty-trash.
+_NOT_IN_LEDGER = "<not in ledger>"
+
+# Number of trashed dataset IDs read in one query.
+_BATCH_SIZE = 10_000
+
+
+def trash_stats(repo: str, by_age: bool = False, ledger_file: str | None = None) -> None:
+    """Report contents of the datastore trash tables.
+
+    Parameters
+    ----------
+    repo : `str`
+        URI of butler repository.
+    by_age : `bool`, optional
+        If `True` then also report numbers of datasets by time in trash. This
+        reads all trashed dataset IDs and looks them up in the ledger, its
+        cost grows with the size of the trash.
+    ledger_file : `str`, optional
+        Path to the ledger of trashed datasets written by ``empty-trash``
+        with ``--older-than`` option, used with ``by_age``. By default a
+        file in the user cache directory is used, separate for each
+        repository.
+
+    Notes
+    -----
+    By default all numbers are computed with aggregate queries, this does
+    not read trash contents and is cheap to run. Time in trash is the time
+    since a dataset was first seen in trash by ``empty-trash``, the same
+    time that is used by its ``--older-than`` option. It is taken from the
+    ledger, which is not updated by this command. Datasets that are not in
+    the ledger are reported separately, ``empty-trash --older-than`` does
+    not remove them. Datasets that were removed from registry have unknown
+    dataset type.
+    """
+    ledger_file = ledger_file or default_ledger_file(repo)
+    with (
+        open_butler(repo, writeable=False) as butler,
+        TrashLedger(ledger_file, repo)
+        if by_age and os.path.exists(ledger_file)
+        else contextlib.nullcontext() as ledger,
+    ):
+        assert isinstance(butler, DirectButler), "This script requires DirectButler."
+        datastores = file_datastores(butler._datastore)
+        if not datastores:
+            print("Butler repository does not have a datastore that supports trash")
+            return
+        for datastore in datastores:
+            trash = DatastoreTrash(datastore)
+            with phase("statistics"):
+                by_dataset_type = trash_statistics(butler, trash)
+                n_records, size = trash.record_totals()
+            total = sum(by_dataset_type.values())
+            print(
+                f"Datastore {trash.name}: {total} trashed dataset{'' if total == 1 else 's'}, "
+                f"{n_records} datastore record{'' if n_records == 1 else 's'}, {format_size(size)}."
+            )
+            if n_removed := by_dataset_type.get(REMOVED_FROM_REGISTRY, 0):
+                print(
+                    f"  {n_removed} trashed dataset{'' if n_removed == 1 else 's'} removed from registry, "
+                    "dataset type cannot be determined."
+                )
+            if by_dataset_type:
+                print("  By dataset type:")
+                for dataset_type, count in sorted(
+                    by_dataset_type.items(), key=lambda item: (-item[1], item[0])
+                ):
+                    print(f"    {dataset_type}: {count}")
+            if by_dataset_type and by_age:
+                with phase("time in trash"):
+                    age_counts = _age_counts(trash, ledger, total)
+                print("  By time in trash:")
+                for bucket in [label for label, _ in _AGE_BUCKETS] + [_NOT_IN_LEDGER]:
+                    if bucket in age_counts:
+                        print(f"    {bucket}: {age_counts[bucket]}")
+
+
+def _age_counts(trash: DatastoreTrash, ledger: TrashLedger | None, total: int) -> dict[str, int]:
+    """Count trashed datasets by time since they were first seen in trash.
+
+    Parameters
+    ----------
+    trash : `DatastoreTrash`
+        Trash of the datastore.
+    ledger : `TrashLedger` or `None`
+        Ledger of trashed datasets, `None` if it does not exist.
+    total : `int`
+        Number of trashed datasets.
+
+    Returns
+    -------
+    counts : `dict` [`str`, `int`]
+        Mapping of age bucket label to the number of trashed datasets.
+    """
+    if ledger is None:
+        return {_NOT_IN_LEDGER: total}
+    counts: dict[str, int] = {}
+    now = time.time()
+    for dataset_ids in trash.batches(_BATCH_SIZE):
+        first_seen = ledger.seen(trash.name, dataset_ids)
+        for dataset_id in dataset_ids:
+            if (seen := first_seen.get(dataset_id)) is None:
+                bucket = _NOT_IN_LEDGER
+            else:
+                bucket = next(label for label, limit in _AGE_BUCKETS if now - seen < limit)
+            counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
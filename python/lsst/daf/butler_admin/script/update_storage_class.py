@@ -23,13 +23,50 @@ from __future__ import annotations
 
 __all__ = ["update_storage_class"]
 
-from lsst.daf.butler import Butler, DatasetType, StorageClass
+import concurrent.futures
+import csv
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import sqlalchemy
+import yaml
+
+from lsst.daf.butler import DatasetRef, StorageClass
 from lsst.daf.butler.direct_butler import DirectButler
+from lsst.daf.butler.registry.bridge.monolithic import MonolithicDatastoreRegistryBridgeManager
 from lsst.daf.butler.registry.datasets.byDimensions import ByDimensionsDatasetRecordStorageManagerUUID
+from lsst.daf.butler.registry.opaque import ByNameOpaqueTableStorage
+
+from .._profiling import phase
+from ._butler import open_butler
+from ._trash import file_datastores, format_size
+
+
+@dataclass(frozen=True)
+class _Mapping:
+    """Storage class mapping for dataset types matching a glob."""
+
+    dataset_type: str
+    """Dataset type name or glob."""
+
+    storage_class: str
+    """Name of the existing storage class."""
+
+    to_storage_class: str
+    """Name of the new storage class."""
 
 
 def update_storage_class(
-    repo: str, update: bool, dataset_type: str, storage_class: str, to_storage_class: str
+    repo: str,
+    update: bool,
+    dataset_type: str | None = None,
+    storage_class: str | None = None,
+    to_storage_class: str | None = None,
+    mapping_file: str | None = None,
+    validate: int = 0,
+    jobs: int = 1,
 ) -> None:
     """Update storage class definition for some dataset types.
 
@@ -39,48 +76,421 @@ def update_storage_class(
         URI of butler repository to update.
     update : `bool`
         Perform actual updates if `True`, print actions otherwise.
-    dataset_type : `str`
+    dataset_type : `str`, optional
         Dataset type name or glob to match multiple dataset types.
-    storage_class : `str`
+    storage_class : `str`, optional
         Name of the existing storage class in the dataset type.
-    to_storage_class : `str`
+    to_storage_class : `str`, optional
         Name of the storage class to assign to matching dataset types.
+    mapping_file : `str`, optional
+        Name of YAML or CSV file with multiple mappings, each mapping has
+        ``dataset_type``, ``from`` and ``to`` keys or columns. Cannot be used
+        together with other mapping arguments.
+    validate : `int`, optional
+        If positive, read this number of existing datasets of each matching
+        dataset type using the new storage class before updating. Database
+        is not updated if any of them fails to read.
+    jobs : `int`, optional
+        Number of threads used to read datasets for validation.
+
+    Notes
+    -----
+    All mappings are checked before any update is made, and all dataset types
+    are updated in a single transaction.
     """
+    arguments = (dataset_type, storage_class, to_storage_class)
+    if mapping_file is not None:
+        if any(arg is not None for arg in arguments):
+            raise ValueError("Dataset type and storage class arguments cannot be used with mapping file.")
+        mappings = _read_mappings(mapping_file)
+    elif dataset_type is None or storage_class is None or to_storage_class is None:
+        raise ValueError("Dataset type and storage class arguments are required without mapping file.")
+    else:
+        mappings = [_Mapping(dataset_type, storage_class, to_storage_class)]
+
     # Connect to the butler.
-    with Butler.from_config(repo, writeable=True) as butler:
+    with open_butler(repo) as butler:
         assert isinstance(butler, DirectButler), "This script requires DirectButler."
 
-        try:
-            old_storage_class = butler.storageClasses.getStorageClass(storage_class)
-        except KeyError:
-            raise ValueError(f"Storage class {storage_class} does not exist") from None
-        try:
-            new_storage_class = butler.storageClasses.getStorageClass(to_storage_class)
-        except KeyError:
-            raise ValueError(f"Storage class {to_storage_class} does not exist") from None
+        with phase("check storage classes"):
+            _check_mappings(butler, mappings)
+        with phase("match dataset types"):
+            updates = _match_dataset_types(butler, mappings)
 
-        # The code below may need to import Python types, check that it works.
-        _check_import(old_storage_class)
-        _check_import(new_storage_class)
-
-        # Check that storage classes are compatible
-        if not new_storage_class.can_convert(old_storage_class):
-            raise TypeError(f"Storage class {to_storage_class} cannot convert from {storage_class}")
-
-        dataset_types = [
-            ds_type
-            for ds_type in butler.registry.queryDatasetTypes(expression=dataset_type)
-            if ds_type.storageClass.name == storage_class
-        ]
-        if not dataset_types:
+        if not updates:
             print("No matching dataset types were found.")
-        elif not update:
+            return
+
+        if not update:
+            with phase("impact"):
+                impact = _impact(butler, updates)
             print("Will update storage class for following dataset types:")
-            for ds_type in dataset_types:
-                print(ds_type)
+            for name, (old_name, new_name) in sorted(updates.items()):
+                count, runs, size = impact.get(name, (0, 0, 0))
+                print(
+                    f"{name}: {old_name} -> {new_name} ({_plural(count, 'dataset')} in "
+                    f"{_plural(runs, 'RUN collection')}, {format_size(size)})"
+                )
+            total_count = sum(count for count, _, _ in impact.values())
+            total_size = sum(size for _, _, size in impact.values())
+            print(f"Total: {_plural(total_count, 'dataset')}, {format_size(total_size)}")
+
+        failures = 0
+        if validate > 0:
+            with phase("validate"):
+                failures = _validate(butler, updates, validate, jobs)
+
+        if not update:
             print("\nDatabase was not updated - use --update option to apply these changes.")
+        elif failures:
+            raise RuntimeError(
+                f"{failures} dataset{'' if failures == 1 else 's'} could not be read with new storage class, "
+                "database was not updated."
+            )
+        else:
+            with phase("update"):
+                _update(butler, {name: new_name for name, (_, new_name) in updates.items()})
+
+
+def _read_mappings(filename: str) -> list[_Mapping]:
+    """Read storage class mappings from a file.
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the file, files with ``.csv`` extension are read as CSV with
+        a header line, all other files are read as YAML list of mappings.
+
+    Returns
+    -------
+    mappings : `list` [`_Mapping`]
+        Mappings read from the file.
+    """
+    with open(filename, newline="") as file:
+        if filename.lower().endswith(".csv"):
+            records: Iterable = csv.DictReader(file)
+        else:
+            records = yaml.safe_load(file) or []
+            if not isinstance(records, list):
+                raise ValueError(f"Mapping file {filename} must contain a list of mappings.")
+        mappings = []
+        for index, record in enumerate(records, 1):
+            try:
+                mappings.append(_Mapping(str(record["dataset_type"]), str(record["from"]), str(record["to"])))
+            except (KeyError, TypeError):
+                raise ValueError(
+                    f"Mapping #{index} in {filename} must define dataset_type, from and to."
+                ) from None
+    if not mappings:
+        raise ValueError(f"Mapping file {filename} does not define any mappings.")
+    return mappings
+
+
+def _check_mappings(butler: DirectButler, mappings: list[_Mapping]) -> None:
+    """Check that storage classes in all mappings exist and are compatible.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+    mappings : `list` [`_Mapping`]
+        Mappings to check.
+    """
+    storage_classes: dict[str, StorageClass] = {}
+    for name in sorted(
+        {name for mapping in mappings for name in (mapping.storage_class, mapping.to_storage_class)}
+    ):
+        try:
+            storage_classes[name] = butler.storageClasses.getStorageClass(name)
+        except KeyError:
+            raise ValueError(f"Storage class {name} does not exist") from None
+        # The code below may need to import Python types, check that it works.
+        _check_import(storage_classes[name])
+
+    # Check that storage classes are compatible
+    for old_name, new_name in sorted(
+        {(mapping.storage_class, mapping.to_storage_class) for mapping in mappings}
+    ):
+        if not storage_classes[new_name].can_convert(storage_classes[old_name]):
+            raise TypeError(f"Storage class {new_name} cannot convert from {old_name}")
+
+
+def _match_dataset_types(butler: DirectButler, mappings: list[_Mapping]) -> dict[str, tuple[str, str]]:
+    """Find dataset types matching any of the mappings.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+    mappings : `list` [`_Mapping`]
+        Mappings to match.
+
+    Returns
+    -------
+    updates : `dict` [`str`, `tuple` [`str`, `str`]]
+        Mapping of dataset type name to its current and new storage class
+        names.
+
+    Notes
+    -----
+    Globs and storage class names are matched by a single query on the
+    dataset type table.
+    """
+    dataset_type_table = _dataset_type_table(butler)
+    db = butler._registry._db
+    # Every mapping becomes a boolean column, only rows that match at least
+    # one mapping are returned, so DatasetType instances are never built.
+    matches = [
+        sqlalchemy.and_(
+            dataset_type_table.columns.storage_class == mapping.storage_class,
+            db.glob_expression(dataset_type_table.columns.name, mapping.dataset_type),
+        )
+        for mapping in mappings
+    ]
+    query = (
+        sqlalchemy.select(
+            dataset_type_table.columns.name,
+            *(match.label(f"mapping_{index}") for index, match in enumerate(matches)),
+        )
+        .where(sqlalchemy.or_(*matches))
+        .order_by(dataset_type_table.columns.name)
+    )
+    with db.query(query) as result:
+        rows = result.all()
+
+    updates: dict[str, tuple[str, str]] = {}
+    for name, *matched in rows:
+        for mapping, is_match in zip(mappings, matched, strict=True):
+            if not is_match:
+                continue
+            update = (mapping.storage_class, mapping.to_storage_class)
+            if updates.setdefault(name, update) != update:
+                raise ValueError(
+                    f"Dataset type {name} matches mappings to different storage classes: "
+                    f"{updates[name][1]} and {mapping.to_storage_class}"
+                )
+    return updates
+
+
+def _impact(butler: DirectButler, names: Iterable[str]) -> dict[str, tuple[int, int, int]]:
+    """Count datasets, RUN collections and artifact sizes for dataset types.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+    names : `~collections.abc.Iterable` [`str`]
+        Names of dataset types.
+
+    Returns
+    -------
+    impact : `dict` [`str`, `tuple` [`int`, `int`, `int`]]
+        Number of datasets, number of RUN collections and total size of file
+        artifacts in bytes for each dataset type name that has datasets.
+
+    Notes
+    -----
+    Counts are obtained with one aggregate query on the dataset table, and
+    sizes with one aggregate query on records table of each file datastore.
+    Artifacts without known size are not included, artifacts shared by
+    several datasets are counted more than once.
+    """
+    registry = butler._registry
+    dataset_manager = registry._managers.datasets
+    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+        "Unexpected type of dataset manager"
+    )
+    dataset_table = dataset_manager._static.dataset
+    dataset_type_table = dataset_manager._static.dataset_type
+    run_column = dataset_table.columns[registry._managers.collections.getRunForeignKeyName()]
+    name_column = dataset_type_table.columns.name
+    joined = dataset_table.join(
+        dataset_type_table, dataset_table.columns.dataset_type_id == dataset_type_table.columns.id
+    )
+    names = sorted(names)
+
+    impact: dict[str, tuple[int, int, int]] = {}
+    query = (
+        sqlalchemy.select(
+            name_column, sqlalchemy.func.count(), sqlalchemy.func.count(sqlalchemy.distinct(run_column))
+        )
+        .select_from(joined)
+        .where(name_column.in_(names))
+        .group_by(name_column)
+    )
+    with registry._db.query(query) as result:
+        for name, count, runs in result:
+            impact[name] = (count, runs, 0)
+
+    for datastore in file_datastores(butler._datastore):
+        assert isinstance(datastore._table, ByNameOpaqueTableStorage), "Unexpected type of records table"
+        records_table = datastore._table._table
+        file_size = records_table.columns.file_size
+        query = (
+            sqlalchemy.select(name_column, sqlalchemy.func.sum(file_size))
+            .select_from(
+                joined.join(records_table, records_table.columns.dataset_id == dataset_table.columns.id)
+            )
+            .where(name_column.in_(names), file_size > 0)
+            .group_by(name_column)
+        )
+        with registry._db.query(query) as result:
+            for name, size in result:
+                count, runs, total = impact[name]
+                impact[name] = (count, runs, total + size)
+    return impact
+
+
+def _plural(count: int, noun: str) -> str:
+    """Return count with a noun in singular or plural form."""
+    return f"{count} {noun}{'' if count == 1 else 's'}"
+
+
+def _sample_datasets(
+    butler: DirectButler, names: Iterable[str], sample_size: int
+) -> dict[str, list[DatasetRef]]:
+    """Select datasets of each dataset type that exist in a datastore.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+    names : `~collections.abc.Iterable` [`str`]
+        Names of dataset types.
+    sample_size : `int`
+        Maximum number of datasets to select for each dataset type.
+
+    Returns
+    -------
+    samples : `dict` [`str`, `list` [`lsst.daf.butler.DatasetRef`]]
+        Selected datasets for each dataset type name.
+    """
+    registry = butler._registry
+    dataset_manager = registry._managers.datasets
+    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+        "Unexpected type of dataset manager"
+    )
+    bridge_manager = registry._managers.datastores
+    assert isinstance(bridge_manager, MonolithicDatastoreRegistryBridgeManager), (
+        "Unexpected type of datastore bridge manager"
+    )
+    dataset_table = dataset_manager._static.dataset
+    dataset_type_table = dataset_manager._static.dataset_type
+    location_table = bridge_manager._tables.dataset_location
+
+    samples: dict[str, list[DatasetRef]] = {}
+    for name in names:
+        # Only datasets with datastore records can be read.
+        stored = (
+            sqlalchemy.select(location_table.columns.dataset_id)
+            .where(location_table.columns.dataset_id == dataset_table.columns.id)
+            .exists()
+        )
+        query = (
+            sqlalchemy.select(dataset_table.columns.id)
+            .join(dataset_type_table, dataset_table.columns.dataset_type_id == dataset_type_table.columns.id)
+            .where(dataset_type_table.columns.name == name, stored)
+            .limit(sample_size)
+        )
+        with registry._db.query(query) as result:
+            ids = list(result.scalars())
+        samples[name] = butler.get_many_datasets(ids)
+    return samples
+
+
+def _validate(butler: DirectButler, updates: dict[str, tuple[str, str]], sample_size: int, jobs: int) -> int:
+    """Read sample datasets using new storage classes and report results.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+    updates : `dict` [`str`, `tuple` [`str`, `str`]]
+        Mapping of dataset type name to its current and new storage class
+        names.
+    sample_size : `int`
+        Maximum number of datasets to read for each dataset type.
+    jobs : `int`
+        Number of threads used to read datasets, each thread uses its own
+        clone of the butler.
+
+    Returns
+    -------
+    failures : `int`
+        Number of datasets that could not be read.
+    """
+    samples = _sample_datasets(butler, sorted(updates), sample_size)
+    tasks = [(ref, updates[name][1]) for name, refs in samples.items() for ref in refs]
+
+    local = threading.local()
+    clones: list[DirectButler] = []
+    lock = threading.Lock()
+
+    def read(ref: DatasetRef, storage_class: str) -> str | None:
+        """Read one dataset, return error message if it fails."""
+        reader: DirectButler | None = butler if jobs == 1 else getattr(local, "butler", None)
+        if reader is None:
+            reader = local.butler = butler.clone()
+            with lock:
+                clones.append(reader)
+        try:
+            dataset = reader.get(ref, storageClass=storage_class)
+        except Exception as exc:
+            return f"{type(exc).__name__}: {exc}"
+        if not butler.storageClasses.getStorageClass(storage_class).validateInstance(dataset):
+            return f"read returned unexpected type {type(dataset).__name__}"
+        return None
+
+    start = time.monotonic()
+    try:
+        if jobs > 1 and len(tasks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                errors = list(executor.map(lambda task: read(*task), tasks))
         else:
-            _update(butler, dataset_types, to_storage_class)
+            errors = [read(*task) for task in tasks]
+    finally:
+        for clone in clones:
+            clone.close()
+    elapsed = time.monotonic() - start
+
+    print("\nValidation of new storage classes:")
+    failures = 0
+    task_errors = iter(zip(tasks, errors, strict=True))
+    for name, refs in samples.items():
+        type_errors = [(ref, error) for (ref, _), error in (next(task_errors) for _ in refs) if error]
+        failures += len(type_errors)
+        print(f"{name}: read {len(refs) - len(type_errors)} of {len(refs)} datasets with {updates[name][1]}")
+        for ref, error in type_errors:
+            print(f"  {ref}: {error}")
+    rate = f" ({len(tasks) / elapsed:.1f} datasets/s)" if elapsed > 0 else ""
+    print(f"Read {len(tasks)} datasets in {elapsed:.2f} s{rate}, {failures} failed.")
+    return failures
+
+
+def _dataset_type_table(butler: DirectButler) -> sqlalchemy.Table:
+    """Return dataset type table of the butler registry.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.DirectButler`
+        Data butler.
+
+    Returns
+    -------
+    table : `sqlalchemy.Table`
+        Table with dataset type definitions.
+
+    Notes
+    -----
+    There is no Butler or Registry interface for direct access to dataset type
+    records, this has to be done using their internals.
+    """
+    # We need SqlRegistry.
+    dataset_manager = butler._registry._managers.datasets
+    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
+        "Unexpected type of dataset manager"
+    )
+    return dataset_manager._static.dataset_type
 
 
 def _check_import(storage_class: StorageClass) -> None:
@@ -100,32 +510,28 @@ def _check_import(storage_class: StorageClass) -> None:
         ) from exc
 
 
-def _update(butler: DirectButler, dataset_types: list[DatasetType], storage_class: str) -> None:
-    """Update database definition of dataset types with new storage class.
+def _update(butler: DirectButler, updates: dict[str, str]) -> None:
+    """Update database definition of dataset types with new storage classes.
 
     Parameters
     ----------
     butler : `lsst.daf.butler.DirectButler`
         Data butler to be updated.
-    dataset_types : `list` [`lsst.daf.butler.DatasetType`]
-        List of data set types to update.
-    storage_class : `str`
-        Name of the storage class.
+    updates : `dict` [`str`, `str`]
+        Mapping of dataset type name to the name of its new storage class.
 
     Notes
     -----
     There is no Butler or Registry interface for this operation, this has to be
     done using their internals.
     """
-    # We need SqlRegistry.
     registry = butler._registry
-    dataset_manager = registry._managers.datasets
-    assert isinstance(dataset_manager, ByDimensionsDatasetRecordStorageManagerUUID), (
-        "Unexpected type of dataset manager"
-    )
-
-    dataset_type_table = dataset_manager._static.dataset_type
+    dataset_type_table = _dataset_type_table(butler)
 
-    rows = [{"ds_name": ds_type.name, "storage_class": storage_class} for ds_type in dataset_types]
-    count = registry._db.update(dataset_type_table, {"name": "ds_name"}, *rows)
+    rows = [{"ds_name": name, "storage_class": storage_class} for name, storage_class in updates.items()]
+    with registry._db.transaction():
+        count = registry._db.update(dataset_type_table, {"name": "ds_name"}, *rows)
+    # Butler may be used after this, e.g. by a batch, and it caches dataset
+    # types.
+    registry.refresh()
     print(f"Updated {count} dataset type record{'' if count == 1 else 's'} in database.")
@@ -0,0 +1,158 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import os
+import unittest
+import unittest.mock
+
+from lsst.daf.butler import Butler, DatasetType, DimensionGroup
+from lsst.daf.butler.tests import MetricsExample, addDataIdValue, addDatasetType, registerMetricsExample
+from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
+from lsst.daf.butler_admin.script import batch
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestBatch(unittest.TestCase):
+    """Test batch script interface."""
+
+    def setUp(self) -> None:
+        self.root = makeTestTempDir(TESTDIR)
+        self.enterContext(unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.root}))
+        config = Butler.makeRepo(self.root)
+        with Butler.from_config(config, run="test") as butler:
+            addDataIdValue(butler, "instrument", "cam0")
+            registerMetricsExample(butler)
+            addDatasetType(butler, "metrics", {"instrument"}, "StructuredDataNoComponents")
+            refs = [butler.put(MetricsExample({"a": 1}), "metrics", instrument="cam0")]
+            butler._datastore.trash(refs)
+            butler.registry.registerDatasetType(
+                DatasetType("a_metadata", DimensionGroup(butler.dimensions), "StructuredDataDict")
+            )
+
+    def tearDown(self) -> None:
+        removeTestTempDir(self.root)
+
+    def write_plan(self, contents: str) -> str:
+        """Write plan file and return its name."""
+        plan = os.path.join(self.root, "plan.yaml")
+        with open(plan, "w") as file:
+            file.write(contents)
+        return plan
+
+    def test_batch(self) -> None:
+        """Run several commands with one butler."""
+        plan = self.write_plan(
+            f"repo: {self.root}\n"
+            "steps:\n"
+            "  - update-storage-class:\n"
+            "      update: true\n"
+            "      dataset-type: '*_metadata'\n"
+            "      storage-class: StructuredDataDict\n"
+            "      to-storage-class: Packages\n"
+            "  - empty-trash: {batch-size: 10}\n"
+            "  - trash-stats\n"
+        )
+        output = io.StringIO()
+        with (
+            unittest.mock.patch.object(Butler, "from_config", wraps=Butler.from_config) as from_config,
+            contextlib.redirect_stdout(output),
+        ):
+            batch(plan)
+        self.assertEqual(from_config.call_count, 1)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], "Step 1/3: update-storage-class")
+        self.assertRegex(lines[2], r"^Step 1/3: update-storage-class finished in \d+\.\d\d s$")
+        self.assertIn(
+            "Datastore FileDatastore@<butlerRoot>: 0 trashed datasets, 0 datastore records, 0 B.", lines
+        )
+        self.assertEqual(lines[-5], "Summary:")
+        self.assertRegex(lines[-1], r"^  Total: \d+\.\d\d s$")
+
+        with Butler.from_config(self.root) as butler:
+            self.assertEqual(butler.get_dataset_type("a_metadata").storageClass.name, "Packages")
+
+    def test_failure(self) -> None:
+        """Stop at the first failed step."""
+        plan = self.write_plan(
+            "steps:\n"
+            "  - update-storage-class:\n"
+            "      update: true\n"
+            "      dataset-type: '*_metadata'\n"
+            "      storage-class: StructuredDataDict\n"
+            "      to-storage-class: NotAClass\n"
+            "  - empty-trash\n"
+        )
+        output = io.StringIO()
+        with (
+            contextlib.redirect_stdout(output),
+            self.assertRaisesRegex(ValueError, "Storage class NotAClass does not exist"),
+        ):
+            batch(plan, repo=self.root)
+        self.assertIn("Skipped 1 remaining step.", output.getvalue())
+        self.assertNotIn("Step 2/2", output.getvalue())
+
+    def test_options(self) -> None:
+        """Check that options are converted in the same way as on command
+        line.
+        """
+        plan = self.write_plan(
+            f"repo: {self.root}\n"
+            "steps:\n"
+            "  - refresh-collection-summary: {collections: 'other*', format: jsonl}\n"
+            "  - refresh-collection-summary: {collections: 'other*,te*', format: jsonl, jobs: '2'}\n"
+            "  - refresh-collection-summary: {collections: ['other*', 'te*'], format: jsonl}\n"
+        )
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            batch(plan)
+        collections = [line.split('"')[3] for line in output.getvalue().splitlines() if line.startswith("{")]
+        self.assertEqual(collections, ["test", "test"])
+
+        for options, message in [
+            ("{method: fast}", "'fast' is not one of"),
+            ("{jobs: 0}", "0 is not in the range"),
+            ("{jobs: [1, 2]}", "only accepts a single value"),
+            ("{update: 'yes'}", "must be true or false"),
+        ]:
+            with self.subTest(options=options):
+                plan = self.write_plan(
+                    f"repo: {self.root}\nsteps:\n  - refresh-collection-summary: {options}\n"
+                )
+                with self.assertRaisesRegex(ValueError, message):
+                    batch(plan)
+
+    def test_invalid_plan(self) -> None:
+        """Check plan validation."""
+        plan = self.write_plan("steps:\n  - empty-trash\n")
+        with self.assertRaisesRegex(ValueError, "does not define repository"):
+            batch(plan)
+        plan = self.write_plan(f"repo: {self.root}\nsteps:\n  - drop-everything\n")
+        with self.assertRaisesRegex(ValueError, "unknown command 'drop-everything'"):
+            batch(plan)
+        plan = self.write_plan(f"repo: {self.root}\nsteps:\n  - empty-trash: {{dry-rum: true}}\n")
+        with self.assertRaisesRegex(ValueError, "unknown option 'dry-rum'"):
+            batch(plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
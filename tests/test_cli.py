@@ -0,0 +1,134 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from click.testing import CliRunner
+
+from lsst.daf.butler import Butler
+from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
+from lsst.daf.butler_admin.cli import get_cli_subcommands
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+# Modules that must not be imported when the command plugin is loaded.
+HEAVY_MODULES = (
+    "lsst.daf.butler_admin.script",
+    "lsst.daf.butler.direct_butler",
+    "lsst.daf.butler.registry.datasets.byDimensions",
+)
+
+PLUGIN_CODE = """
+import json, sys
+from lsst.daf.butler_admin.cli import get_cli_subcommands
+commands = get_cli_subcommands()
+print(json.dumps({"commands": [command.name for command in commands], "modules": sorted(sys.modules)}))
+"""
+
+
+class TestCli(unittest.TestCase):
+    """Test case for command line plugin."""
+
+    def setUp(self) -> None:
+        self.root = makeTestTempDir(TESTDIR)
+
+    def tearDown(self) -> None:
+        removeTestTempDir(self.root)
+
+    def test_lazy_import(self) -> None:
+        """Check that loading the plugin does not import script modules."""
+        # New interpreter is needed, other tests import everything.
+        output = subprocess.run(
+            [sys.executable, "-c", PLUGIN_CODE], check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output)
+        self.assertEqual(result["commands"], ["admin"])
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, result["modules"])
+
+    def test_command(self) -> None:
+        """Check that commands import script modules when they run."""
+        butler_root = tempfile.mkdtemp(dir=self.root)
+        Butler.makeRepo(butler_root)
+        # Writeable butler creates datastore tables.
+        Butler.from_config(butler_root, writeable=True).close()
+
+        (admin,) = get_cli_subcommands()
+        result = CliRunner().invoke(admin, ["trash-stats", butler_root])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("0 trashed datasets", result.output)
+
+    def test_profile(self) -> None:
+        """Check profiling summary of a command."""
+        butler_root = tempfile.mkdtemp(dir=self.root)
+        Butler.makeRepo(butler_root)
+        Butler.from_config(butler_root, writeable=True).close()
+        profile_file = os.path.join(self.root, "profile.json")
+        cprofile_file = os.path.join(self.root, "profile.prof")
+
+        (admin,) = get_cli_subcommands()
+        result = CliRunner().invoke(
+            admin, ["--profile", profile_file, "--cprofile", cprofile_file, "trash-stats", butler_root]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with open(profile_file) as file:
+            summary = json.load(file)
+        self.assertEqual(summary["command"], "trash-stats")
+        self.assertEqual(set(summary["phases"]), {"butler", "statistics"})
+        for stats in summary["phases"].values():
+            self.assertEqual(stats["calls"], 1)
+            self.assertGreater(stats["sql_count"], 0)
+        self.assertEqual(
+            summary["sql_count"], sum(stats["sql_count"] for stats in summary["phases"].values())
+        )
+        self.assertGreaterEqual(summary["wall_time"], summary["phases"]["butler"]["wall_time"])
+        self.assertTrue(os.path.exists(cprofile_file))
+
+    def test_fanout_args(self) -> None:
+        """Check that fanout passes options after command to the command,
+        including options with the same names as its own.
+        """
+        repos = os.path.join(self.root, "repos.txt")
+        with open(repos, "w") as file:
+            file.write(f"{self.root}\n")
+
+        (admin,) = get_cli_subcommands()
+        fanout = admin.commands["fanout"]
+        ctx = fanout.make_context(
+            "fanout", ["--repos", repos, "empty-trash", "--jobs", "8", "--batch-size", "5"]
+        )
+        self.assertEqual(ctx.params["jobs"], 4)
+        self.assertEqual(ctx.params["command"], "empty-trash")
+        self.assertEqual(ctx.params["args"], ("--jobs", "8", "--batch-size", "5"))
+        ctx = fanout.make_context("fanout", ["--repos", repos, "--jobs", "2", "trash-stats", "--by-age"])
+        self.assertEqual(ctx.params["jobs"], 2)
+        self.assertEqual(ctx.params["args"], ("--by-age",))
+
+
+if __name__ == "__main__":
+    unittest.main()
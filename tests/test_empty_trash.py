@@ -19,8 +19,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import io
+import json
 import os
+import sqlite3
 import unittest
+import unittest.mock
 
 from lsst.daf.butler import Butler
 from lsst.daf.butler.tests import (
@@ -32,6 +37,9 @@ from lsst.daf.butler.tests import (
 )
 from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
 from lsst.daf.butler_admin.script import empty_trash
+from lsst.daf.butler_admin.script._check_cache import default_cache_file
+from lsst.daf.butler_admin.script._trash import TrashJournal, format_size
+from lsst.resources.file import FileResourcePath
 
 TESTDIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -41,6 +49,8 @@ class TestEmptyTrash(unittest.TestCase, DatasetTestHelper):
 
     def setUp(self) -> None:
         self.root = makeTestTempDir(TESTDIR)
+        # Keep trash ledger in temporary directory.
+        self.enterContext(unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.root}))
         config = Butler.makeRepo(self.root)
         self.butler = Butler.from_config(config, run="test")
         self.enterContext(self.butler)
@@ -97,6 +107,235 @@ class TestEmptyTrash(unittest.TestCase, DatasetTestHelper):
         for uri in uris:
             self.assertFalse(uri.exists(), str(uri))
 
+    def test_empty_trash_batches(self) -> None:
+        """Trash emptying in batches."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        with self.assertLogs(level="INFO") as cm:
+            empty_trash(self.root, dry_run=True, verbose=False, batch_size=3)
+        log = "\n".join(cm.output)
+        self.assertIn("Batch 4: processed 10 trashed datasets, would have removed 10", log)
+        self.assertIn("Would have Removed 10", log)
+        for uri in uris:
+            self.assertTrue(uri.exists())
+
+        with self.assertLogs(level="INFO") as cm, contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=False, verbose=True, batch_size=3)
+        log = "\n".join(cm.output)
+        self.assertIn("Batch 4: processed 10 trashed datasets, removed 10", log)
+        self.assertIn("Removed 10", log)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 11)
+        for uri in uris:
+            self.assertFalse(uri.exists(), str(uri))
+
+        # Trash is empty now.
+        with self.assertLogs(level="INFO") as cm:
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=3)
+        self.assertIn("Removed 0", "\n".join(cm.output))
+
+    def test_empty_trash_log_file(self) -> None:
+        """Trash emptying with URIs written to a file."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        log_file = os.path.join(self.root, "removed.txt")
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=True, verbose=True, sort=True)
+        self.assertEqual(
+            stdout.getvalue().splitlines()[-11:], ["Removed the following:"] + sorted(map(str, uris))
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=4, log_file=log_file)
+        self.assertEqual(stdout.getvalue(), "")
+        with open(log_file) as file:
+            self.assertEqual(sorted(file.read().splitlines()), sorted(map(str, uris)))
+
+    def test_empty_trash_space_report(self) -> None:
+        """Report of reclaimable space in dry-run mode."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        sizes = [uri.size() for uri in uris]
+        # Half of datasets remain in registry, their run and dataset type is
+        # known.
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs[5:])
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=True, verbose=False, jobs=2)
+        lines = stdout.getvalue().splitlines()
+        self.assertIn(f"10 file artifacts, {format_size(sum(sizes))}.", lines[0])
+        self.assertIn(f"  test: 5 file artifacts, {format_size(sum(sizes[:5]))}", lines)
+        self.assertIn(f"  metrics: 5 file artifacts, {format_size(sum(sizes[:5]))}", lines)
+        self.assertIn(f"  <removed from registry>: 5 file artifacts, {format_size(sum(sizes[5:]))}", lines)
+        self.assertIn(
+            f"5 file artifacts, {format_size(sum(sizes[5:]))}, belong to datasets removed from registry, "
+            "their run and dataset type cannot be determined.",
+            lines,
+        )
+        self.assertIn(f"  {uris[0].parent().parent()}: 10 file artifacts, {format_size(sum(sizes))}", lines)
+
+        # Sizes that are missing from records are read from storage, and
+        # artifacts that do not exist are reported.
+        records_table = self.butler._datastore._table
+        records_table._db.update(
+            records_table._table,
+            {"dataset_id": "id"},
+            *[{"id": ref.id, "file_size": -1} for ref in self.refs],
+        )
+        uris[0].remove()
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=True, verbose=False, jobs=2)
+        lines = stdout.getvalue().splitlines()
+        self.assertIn(f"9 file artifacts, {format_size(sum(sizes[1:]))}.", lines[0])
+        self.assertEqual(lines[1], "1 file artifact do not exist.")
+
+    def test_empty_trash_jobs(self) -> None:
+        """Parallel trash emptying with failures."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        attempts: dict[str, int] = {}
+        remove = FileResourcePath.remove
+
+        def flaky_remove(uri: FileResourcePath) -> None:
+            # First artifact can never be removed, second fails once.
+            attempts[uri.path] = attempts.get(uri.path, 0) + 1
+            if uri.path == uris[0].path or (uri.path == uris[1].path and attempts[uri.path] == 1):
+                raise PermissionError(f"Cannot remove {uri}")
+            remove(uri)
+
+        with (
+            unittest.mock.patch.object(FileResourcePath, "remove", flaky_remove),
+            unittest.mock.patch("lsst.daf.butler_admin.script.empty_trash._RETRY_DELAY", 0.0),
+            self.assertLogs(level="INFO") as cm,
+            contextlib.redirect_stdout(io.StringIO()) as stdout,
+        ):
+            empty_trash(self.root, dry_run=False, verbose=False, jobs=4)
+        log = "\n".join(cm.output)
+        self.assertIn(f"Failed to remove file artifact {uris[0]}", log)
+        self.assertIn("Removed 9", log)
+        self.assertEqual(
+            stdout.getvalue(), "Failed to remove 1 file artifact, their datasets were left in trash.\n"
+        )
+        self.assertEqual(attempts[uris[1].path], 2)
+        self.assertTrue(uris[0].exists())
+        for uri in uris[1:]:
+            self.assertFalse(uri.exists(), str(uri))
+
+        # Dataset with failed artifact is still in trash.
+        with self.assertLogs(level="INFO") as cm:
+            empty_trash(self.root, dry_run=False, verbose=False, jobs=4)
+        self.assertIn("Removed 1 file artifact", "\n".join(cm.output))
+        self.assertFalse(uris[0].exists())
+
+    def test_empty_trash_resume(self) -> None:
+        """Resume trash emptying after interruption."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        # Pretend that previous run removed some artifacts and was killed
+        # before updating trash table.
+        journal_file = default_cache_file("empty_trash_journal.jsonl", self.root)
+        os.makedirs(os.path.dirname(journal_file))
+        with open(journal_file, "w") as file:
+            for uri in uris[:3]:
+                uri.remove()
+                entry = {"repo": self.root, "datastore": "FileDatastore@<butlerRoot>", "uri": str(uri)}
+                print(json.dumps(entry), file=file)
+            # Incomplete last line.
+            print('{"repo": ', end="", file=file)
+
+        with self.assertRaisesRegex(ValueError, "3 artifacts removed by interrupted run"):
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=4)
+        self.assertTrue(os.path.exists(journal_file))
+
+        removed: list[str] = []
+        remove = FileResourcePath.remove
+
+        def counting_remove(uri: FileResourcePath) -> None:
+            removed.append(str(uri))
+            remove(uri)
+
+        with (
+            unittest.mock.patch.object(FileResourcePath, "remove", counting_remove),
+            self.assertLogs(level="INFO") as cm,
+        ):
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=4, resume=True)
+        self.assertIn("Removed 10", "\n".join(cm.output))
+        self.assertEqual(sorted(removed), sorted(str(uri) for uri in uris[3:]))
+        self.assertFalse(os.path.exists(journal_file))
+        with self.assertLogs(level="INFO") as cm:
+            empty_trash(self.root, dry_run=True, verbose=False)
+        self.assertIn("Would have Removed 0", "\n".join(cm.output))
+
+        # Journal of interrupted run on other repository is not used.
+        other_journal_file = default_cache_file("empty_trash_journal.jsonl", "/other/repo")
+        with open(other_journal_file, "w") as file:
+            print(json.dumps({"repo": "/other/repo", "datastore": "", "uri": ""}), file=file)
+        with self.assertLogs(level="INFO") as cm:
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=4)
+        self.assertIn("Removed 0", "\n".join(cm.output))
+        self.assertTrue(os.path.exists(other_journal_file))
+
+        # Journal is made for different repository.
+        with self.assertRaisesRegex(ValueError, "different repository"):
+            empty_trash(self.root, dry_run=False, verbose=False, resume=True, journal_file=other_journal_file)
+
+        # Journal cannot be used by two processes at once.
+        with TrashJournal(journal_file, self.root):
+            with self.assertRaisesRegex(RuntimeError, "used by another process"):
+                empty_trash(self.root, dry_run=False, verbose=False, batch_size=4)
+        self.assertFalse(os.path.exists(journal_file))
+
+    def test_empty_trash_limits(self) -> None:
+        """Trash emptying with time, count and age limits."""
+        uris = [self.butler.getURI(ref) for ref in self.refs]
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        with self.assertRaisesRegex(ValueError, "Cannot parse age string"):
+            empty_trash(self.root, dry_run=False, verbose=False, older_than="yesterday")
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=False, verbose=False, max_seconds=0)
+        self.assertIn("Stopped after reaching time limit, 10 trashed datasets left", stdout.getvalue())
+
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=False, verbose=False, batch_size=3, max_artifacts=4)
+        self.assertIn("Stopped after reaching artifact limit, 6 trashed datasets left", stdout.getvalue())
+        self.assertEqual(sum(not uri.exists() for uri in uris), 4)
+
+        # Datasets are first seen in trash now, none are removed, new ledger
+        # is reported.
+        ledger_file = os.path.join(self.root, "ledger.sqlite3")
+        with (
+            contextlib.redirect_stdout(io.StringIO()) as stdout,
+            self.assertLogs(level="WARNING") as cm,
+        ):
+            empty_trash(self.root, dry_run=False, verbose=False, older_than="1d", ledger_file=ledger_file)
+        self.assertIn("Skipped 6 trashed datasets", stdout.getvalue())
+        self.assertIn(f"Created new trash ledger {ledger_file}", "\n".join(cm.output))
+        self.assertEqual(sum(not uri.exists() for uri in uris), 4)
+
+        # Make them look older.
+        with contextlib.closing(sqlite3.connect(ledger_file)) as connection, connection:
+            connection.execute("UPDATE trash_seen SET first_seen = first_seen - 2 * 24 * 3600")
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            empty_trash(self.root, dry_run=False, verbose=False, older_than="1d", ledger_file=ledger_file)
+        self.assertEqual(stdout.getvalue(), "")
+        for uri in uris:
+            self.assertFalse(uri.exists(), str(uri))
+
+        # Default ledger is separate for each repository.
+        with self.assertLogs(level="WARNING"):
+            empty_trash(self.root, dry_run=False, verbose=False, older_than="1d")
+        self.assertTrue(os.path.exists(default_cache_file("trash_ledger.sqlite3", self.root)))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from lsst.daf.butler import Butler
+from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
+from lsst.daf.butler_admin.script import fanout
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestFanout(unittest.TestCase):
+    """Test fanout script interface."""
+
+    def setUp(self) -> None:
+        self.root = makeTestTempDir(TESTDIR)
+        # Keep local cache files in temporary directory, worker processes
+        # inherit environment.
+        self.enterContext(unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.root}))
+
+    def tearDown(self) -> None:
+        removeTestTempDir(self.root)
+
+    def test_fanout(self) -> None:
+        """Run a command on several repositories."""
+        repos = []
+        for _ in range(2):
+            butler_root = tempfile.mkdtemp(dir=self.root)
+            Butler.makeRepo(butler_root)
+            Butler.from_config(butler_root, writeable=True).close()
+            repos.append(butler_root)
+        missing = os.path.join(self.root, "missing")
+        repos_file = os.path.join(self.root, "repos.txt")
+        with open(repos_file, "w") as file:
+            file.write("# Test repositories.\n\n" + "\n".join([*repos, missing]) + "\n")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            failures = fanout(repos_file, 2, "trash-stats", [])
+        self.assertEqual(failures, 1)
+        lines = output.getvalue().splitlines()
+        for repo in repos:
+            self.assertRegex(output.getvalue(), rf"=== {repo} \[\d/3\] OK \(\d+\.\d\d s\)")
+        self.assertRegex(output.getvalue(), rf"=== {missing} \[\d/3\] FAILED: ")
+        self.assertEqual(
+            lines.count(
+                "Datastore FileDatastore@<butlerRoot>: 0 trashed datasets, 0 datastore records, 0 B."
+            ),
+            2,
+        )
+        self.assertRegex(lines[-2], "^Summary: trash-stats on 3 repositories, 2 succeeded, 1 failed")
+        self.assertEqual(lines[-1], f"  Failed: {missing}")
+
+        # Repository placeholder.
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            failures = fanout(repos_file, 2, "update-storage-class", ["{repo}", "*", "Packages", "Packages"])
+        self.assertEqual(failures, 1)
+        self.assertEqual(output.getvalue().count("No matching dataset types were found."), 2)
+
+        # Results reported with log messages are in the output.
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            failures = fanout(repos_file, 2, "empty-trash", ["--batch-size", "10"])
+        self.assertEqual(failures, 1)
+        self.assertEqual(output.getvalue().count("Removed 0 file artifacts from datastore"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
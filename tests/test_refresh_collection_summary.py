@@ -0,0 +1,301 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import unittest
+import unittest.mock
+from typing import Any
+
+from lsst.daf.butler import Butler, CollectionType, DatasetType, Timespan
+from lsst.daf.butler.tests import MetricsExample, addDataIdValue, registerMetricsExample
+from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
+from lsst.daf.butler_admin.script import refresh_collection_summary
+from lsst.daf.butler_admin.script._check_cache import CheckCache, default_cache_file
+from lsst.daf.butler_admin.script._summaries import SummaryTables
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestRefreshCollectionSummary(unittest.TestCase):
+    """Test case for refresh_collection_summary script."""
+
+    def setUp(self) -> None:
+        self.root = makeTestTempDir(TESTDIR)
+        # Keep check cache in temporary directory.
+        self.enterContext(unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.root}))
+        Butler.makeRepo(self.root)
+        butler = Butler.from_config(self.root, writeable=True)
+        self.enterContext(butler)
+
+        for inst in ("cam0", "cam1", "cam2"):
+            addDataIdValue(butler, "instrument", inst)
+        registerMetricsExample(butler)
+        storage_class = "StructuredDataNoComponents"
+        for name, dimensions, is_calibration in (
+            ("metrics", ["instrument"], False),
+            ("other", ["instrument"], False),
+            ("global", [], False),
+            ("bias", ["instrument"], True),
+        ):
+            butler.registry.registerDatasetType(
+                DatasetType(
+                    name, dimensions, storage_class, universe=butler.dimensions, isCalibration=is_calibration
+                )
+            )
+
+        refs: dict[str, list] = {}
+        for run in ("run1", "run2", "run3"):
+            butler.registry.registerRun(run)
+            run_refs = refs.setdefault(run, [])
+            for i, inst in enumerate(("cam0", "cam1", "cam2")):
+                run_refs.append(butler.put(MetricsExample({"a": i}), "metrics", instrument=inst, run=run))
+            run_refs.append(butler.put(MetricsExample({"a": 0}), "global", run=run))
+            if run != "run3":
+                run_refs.append(butler.put(MetricsExample({"a": 0}), "other", instrument="cam0", run=run))
+            run_refs.append(butler.put(MetricsExample({"a": 0}), "bias", instrument="cam0", run=run))
+
+        butler.registry.registerCollection("tagged", CollectionType.TAGGED)
+        butler.registry.associate("tagged", refs["run1"][:4])
+        butler.registry.registerCollection("calib", CollectionType.CALIBRATION)
+        butler.registry.certify("calib", [refs["run1"][-1]], Timespan(None, None))
+        butler.registry.registerCollection("chain", CollectionType.CHAINED)
+        butler.registry.setCollectionChain("chain", ["run1", "run2"])
+
+        # Removing all datasets of one type from a collection leaves stale
+        # summary.
+        other_refs = [ref for ref in refs["run2"] if ref.datasetType.name == "other"]
+        butler.pruneDatasets(other_refs, purge=True, unstore=True, disassociate=True)
+
+    def tearDown(self) -> None:
+        removeTestTempDir(self.root)
+
+    def run_script(self, **kwargs: Any) -> str:
+        """Run the script and return its standard output."""
+        kwargs.setdefault("update", False)
+        kwargs.setdefault("tagged", False)
+        # Most tests want to run actual checks, aggregate method has no cache.
+        kwargs.setdefault("ignore_cache", kwargs.get("method", "aggregate") != "aggregate")
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            refresh_collection_summary(self.root, **kwargs)
+        return stdout.getvalue()
+
+    def test_check(self) -> None:
+        """Check summaries using different methods."""
+        expected = [
+            "Summary for CALIBRATION collection calib is consistent with 1 dataset types.",
+            "Summary for RUN collection run1 is consistent with 4 dataset types.",
+            "Summary for RUN collection run2 contains 1 extra dataset types.",
+            "Summary for RUN collection run3 is consistent with 3 dataset types.",
+            "Summary for TAGGED collection tagged is consistent with 2 dataset types.",
+        ]
+        for method in ("query", "aggregate", "probe"):
+            with self.subTest(method=method):
+                self.assertEqual(self.run_script(method=method).splitlines(), expected)
+                self.assertEqual(self.run_script(method=method, tagged=True).splitlines(), expected[-1:])
+
+    def test_select(self) -> None:
+        """Check selection of collections by name and ingest date."""
+        tomorrow = (datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=1)).strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+        for method in ("query", "aggregate", "probe"):
+            with self.subTest(method=method):
+                output = self.run_script(method=method, collections=["run*", "tagged"])
+                self.assertEqual(
+                    [line.split()[4] for line in output.splitlines()], ["run1", "run2", "run3", "tagged"]
+                )
+                output = self.run_script(method=method, collections=["run[12]"], since="2000-01-01")
+                self.assertEqual([line.split()[4] for line in output.splitlines()], ["run1", "run2"])
+                output = self.run_script(method=method, since=tomorrow)
+                self.assertEqual(output, "")
+
+        with self.assertRaisesRegex(ValueError, "Cannot parse time string"):
+            self.run_script(since="yesterday")
+
+        # Update only selected collections.
+        output = self.run_script(update=True, collections=["run1"])
+        self.assertEqual(output, "Removed 0 stale collection summary records.\n")
+        output = self.run_script(update=True, since=tomorrow)
+        self.assertEqual(output, "Removed 0 stale collection summary records.\n")
+        output = self.run_script(update=True, collections=["run*"], since="2000-01-01")
+        self.assertEqual(output, "Removed 1 stale collection summary record.\n")
+
+    def test_cache(self) -> None:
+        """Check that results for unchanged collections are cached."""
+        cache_file = default_cache_file("summary_check.sqlite3", self.root)
+        # Aggregate method does not use cache.
+        output = self.run_script(method="aggregate", ignore_cache=False)
+        self.assertFalse(os.path.exists(cache_file))
+        with self.assertLogs(level="WARNING") as cm:
+            self.assertEqual(self.run_script(method="aggregate", ignore_cache=True), output)
+        self.assertIn("cache options are ignored", "\n".join(cm.output))
+        self.assertFalse(os.path.exists(cache_file))
+        self.assertEqual(self.run_script(method="probe", ignore_cache=False), output)
+        self.assertTrue(os.path.exists(cache_file))
+        for method in ("query", "probe"):
+            with self.subTest(method=method):
+                with self.assertLogs(level="INFO") as cm:
+                    self.assertEqual(self.run_script(method=method, ignore_cache=False), output)
+                self.assertIn("Using cached check results for 5 out of 5 collections", "\n".join(cm.output))
+
+        with self.assertLogs(level="INFO") as cm:
+            self.assertEqual(self.run_script(method="probe", ignore_cache=True), output)
+        self.assertIn("Using cached check results for 0 out of 5 collections", "\n".join(cm.output))
+
+        # Updating summary changes fingerprint.
+        self.run_script(update=True, collections=["run2"])
+        with self.assertLogs(level="INFO") as cm:
+            output = self.run_script(method="probe", ignore_cache=False)
+        self.assertIn("Using cached check results for 4 out of 5 collections", "\n".join(cm.output))
+        self.assertIn("run2 is consistent with 3 dataset types", output)
+
+        # Explicit cache location.
+        cache_file = os.path.join(self.root, "cache.sqlite3")
+        with self.assertLogs(level="INFO") as cm:
+            self.assertEqual(
+                self.run_script(method="probe", cache_file=cache_file, ignore_cache=False), output
+            )
+        self.assertIn("Using cached check results for 0 out of 5 collections", "\n".join(cm.output))
+        self.assertTrue(os.path.exists(cache_file))
+
+    def test_shared_cache(self) -> None:
+        """Check that cache file can be used by two processes at once."""
+        cache_file = os.path.join(self.root, "cache.sqlite3")
+        with CheckCache(cache_file, self.root) as cache:
+            cache.put("run1", "fingerprint", {"metrics"}, {"metrics"})
+        with CheckCache(cache_file, self.root) as cache1, CheckCache(cache_file, "/other/repo") as cache2:
+            self.assertEqual(cache1.get("run1", "fingerprint"), ({"metrics"}, {"metrics"}))
+            self.assertIsNone(cache1.get("run1", "changed"))
+            # Cache hit in one process does not lock the file for another.
+            cache2.put("run1", "fingerprint", set(), set())
+            self.assertEqual(cache2.evict(3600), 0)
+        with CheckCache(cache_file, "/other/repo") as cache:
+            self.assertEqual(cache.get("run1", "fingerprint"), (set(), set()))
+
+    def test_recheck(self) -> None:
+        """Check that false alarms caused by concurrent updates are excluded
+        by checking inconsistent collections again.
+        """
+        expected = self.run_script()
+        summary_contents = SummaryTables.summary_contents
+
+        def stale_summary_contents(tables: SummaryTables, collections: list) -> dict:
+            # Pretend that all datasets were added after summary was read.
+            if len(collections) > 1:
+                return {}
+            return summary_contents(tables, collections)
+
+        with unittest.mock.patch.object(SummaryTables, "summary_contents", stale_summary_contents):
+            for method in ("aggregate", "probe"):
+                with self.subTest(method=method):
+                    self.assertEqual(self.run_script(method=method), expected)
+                    output = self.run_script(method=method, format="jsonl")
+                    records = [json.loads(line) for line in output.splitlines()]
+                    self.assertTrue(all(record["rechecked"] for record in records))
+                    output = self.run_script(method=method, recheck=False)
+                    self.assertEqual(output.count("missing dataset types"), 5)
+
+    def test_jsonl(self) -> None:
+        """Check JSON report format and output file."""
+        for method in ("query", "aggregate", "probe"):
+            with self.subTest(method=method):
+                output = self.run_script(method=method, format="jsonl")
+                records = {record["collection"]: record for record in map(json.loads, output.splitlines())}
+                self.assertEqual(list(records), ["calib", "run1", "run2", "run3", "tagged"])
+                self.assertEqual(records["run2"]["type"], "RUN")
+                self.assertFalse(records["run2"]["consistent"])
+                self.assertEqual(records["run2"]["extra"], ["other"])
+                self.assertEqual(records["run2"]["missing"], [])
+                self.assertEqual(records["run2"]["dataset_types"], 3)
+                self.assertTrue(records["run1"]["consistent"])
+                self.assertFalse(records["run1"]["cached"])
+                if method == "aggregate":
+                    self.assertNotIn("elapsed", records["run1"])
+                else:
+                    self.assertGreaterEqual(records["run1"]["elapsed"], 0.0)
+
+        output_file = os.path.join(self.root, "report.txt")
+        self.assertEqual(self.run_script(output=output_file), "")
+        with open(output_file) as file:
+            self.assertEqual(file.read(), self.run_script())
+
+        with self.assertRaisesRegex(ValueError, "Unknown output format"):
+            self.run_script(format="xml")
+
+    def test_parallel(self) -> None:
+        """Check that parallel and serial query checks give the same output."""
+        serial = self.run_script(method="query")
+        for jobs in (2, 4, 10):
+            with self.subTest(jobs=jobs):
+                self.assertEqual(self.run_script(method="query", jobs=jobs), serial)
+
+    def test_update(self) -> None:
+        """Check that update removes stale summary entries."""
+        output = self.run_script(update=True)
+        self.assertEqual(output, "Removed 1 stale collection summary record.\n")
+        output = self.run_script()
+        self.assertNotIn("extra", output)
+        self.assertIn("Summary for RUN collection run2 is consistent with 3 dataset types.", output)
+
+    def test_parallel_update(self) -> None:
+        """Check that update with parallel workers removes stale summary
+        entries.
+        """
+        output = self.run_script(update=True, jobs=3)
+        self.assertEqual(output, "Removed 1 stale collection summary record.\n")
+        output = self.run_script()
+        self.assertNotIn("extra", output)
+        self.assertIn("Summary for RUN collection run2 is consistent with 3 dataset types.", output)
+        output = self.run_script(update=True, jobs=3)
+        self.assertEqual(output, "Removed 0 stale collection summary records.\n")
+
+    def test_chunked_update(self) -> None:
+        """Check chunked update and resuming from checkpoint."""
+        checkpoint = os.path.join(self.root, "checkpoint.json")
+        with self.assertRaisesRegex(ValueError, "only be used with chunked update"):
+            self.run_script(update=True, checkpoint=checkpoint)
+
+        # Pretend that previous run was interrupted after run2 collection.
+        with open(checkpoint, "w") as file:
+            json.dump({"repo": self.root, "last_collection": "run2"}, file)
+        output = self.run_script(update=True, chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual(output, "Removed 0 stale collection summary records.\n")
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertIn("run2 contains 1 extra dataset types", self.run_script())
+
+        with open(checkpoint, "w") as file:
+            json.dump({"repo": "/other/repo", "last_collection": "run2"}, file)
+        with self.assertRaisesRegex(ValueError, "different repository"):
+            self.run_script(update=True, chunk_size=2, checkpoint=checkpoint)
+        os.remove(checkpoint)
+
+        output = self.run_script(update=True, chunk_size=2, checkpoint=checkpoint)
+        self.assertEqual(output, "Removed 1 stale collection summary record.\n")
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertIn("run2 is consistent with 3 dataset types", self.run_script())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# This file is part of daf_butler_admin.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import os
+import sqlite3
+import unittest
+import unittest.mock
+from typing import Any
+
+from lsst.daf.butler import Butler
+from lsst.daf.butler.tests import MetricsExample, addDataIdValue, addDatasetType, registerMetricsExample
+from lsst.daf.butler.tests.utils import makeTestTempDir, removeTestTempDir
+from lsst.daf.butler_admin.script import trash_stats
+from lsst.daf.butler_admin.script._trash import TrashLedger, format_size
+
+TESTDIR = os.path.abspath(os.path.dirname(__file__))
+
+
+class TestTrashStats(unittest.TestCase):
+    """Test trash-stats script interface."""
+
+    def setUp(self) -> None:
+        self.root = makeTestTempDir(TESTDIR)
+        # Keep trash ledger in temporary directory.
+        self.enterContext(unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.root}))
+        config = Butler.makeRepo(self.root)
+        self.butler = Butler.from_config(config, run="test")
+        self.enterContext(self.butler)
+
+        for inst in ("cam0", "cam1", "cam2", "cam3"):
+            addDataIdValue(self.butler, "instrument", inst)
+        registerMetricsExample(self.butler)
+        addDatasetType(self.butler, "metrics", {"instrument"}, "StructuredDataNoComponents")
+        addDatasetType(self.butler, "other", {"instrument"}, "StructuredDataNoComponents")
+        self.refs = [
+            self.butler.put(MetricsExample({"a": i}), dataset_type, instrument=inst)
+            for i, inst in enumerate(("cam0", "cam1", "cam2", "cam3"))
+            for dataset_type in ("metrics", "other")
+        ]
+
+    def tearDown(self) -> None:
+        removeTestTempDir(self.root)
+
+    def run_script(self, **kwargs: Any) -> list[str]:
+        """Run the script and return lines of its standard output."""
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            trash_stats(self.root, **kwargs)
+        return stdout.getvalue().splitlines()
+
+    def test_trash_stats(self) -> None:
+        """Report trash contents."""
+        self.assertEqual(
+            self.run_script(),
+            ["Datastore FileDatastore@<butlerRoot>: 0 trashed datasets, 0 datastore records, 0 B."],
+        )
+
+        size = sum(self.butler.getURI(ref).size() for ref in self.refs[:6])
+        self.butler._datastore.trash(self.refs[:6])
+        # Datasets removed from registry have no dataset type.
+        self.butler._registry.removeDatasets(self.refs[:2])
+        expected = [
+            "Datastore FileDatastore@<butlerRoot>: 6 trashed datasets, 6 datastore records, "
+            f"{format_size(size)}.",
+            "  2 trashed datasets removed from registry, dataset type cannot be determined.",
+            "  By dataset type:",
+            "    <removed from registry>: 2",
+            "    metrics: 2",
+            "    other: 2",
+        ]
+        self.assertEqual(self.run_script(), expected)
+        # Without ledger time in trash is not known.
+        self.assertEqual(
+            self.run_script(by_age=True), expected + ["  By time in trash:", "    <not in ledger>: 6"]
+        )
+
+    def test_removed_from_registry(self) -> None:
+        """Report trash whose datasets were all removed from registry, as
+        it is done by pruneDatasets, with time in trash from the ledger.
+        """
+        size = sum(self.butler.getURI(ref).size() for ref in self.refs)
+        self.butler._datastore.trash(self.refs)
+        self.butler._registry.removeDatasets(self.refs)
+
+        # Ledger knows about some datasets, same as after empty-trash with
+        # --older-than option.
+        ledger_file = os.path.join(self.root, "ledger.sqlite3")
+        datastore = "FileDatastore@<butlerRoot>"
+        with TrashLedger(ledger_file, self.root) as ledger:
+            ledger.first_seen(datastore, [ref.id for ref in self.refs[:5]])
+        with contextlib.closing(sqlite3.connect(ledger_file)) as connection, connection:
+            connection.execute(
+                "UPDATE trash_seen SET first_seen = first_seen - 2 * 24 * 3600 WHERE dataset_id IN (?, ?)",
+                (str(self.refs[0].id), str(self.refs[1].id)),
+            )
+        self.assertEqual(
+            self.run_script(by_age=True, ledger_file=ledger_file),
+            [
+                f"Datastore {datastore}: 8 trashed datasets, 8 datastore records, {format_size(size)}.",
+                "  8 trashed datasets removed from registry, dataset type cannot be determined.",
+                "  By dataset type:",
+                "    <removed from registry>: 8",
+                "  By time in trash:",
+                "    < 1 day: 3",
+                "    1-7 days: 2",
+                "    <not in ledger>: 3",
+            ],
+        )
+        # Ledger is not updated by this command.
+        with TrashLedger(ledger_file, self.root) as ledger:
+            self.assertEqual(len(ledger.seen(datastore, [ref.id for ref in self.refs])), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
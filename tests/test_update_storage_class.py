@@ -19,6 +19,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import io
 import os
 import tempfile
 import unittest
@@ -130,6 +132,155 @@ class TestUpdateStorageClass(unittest.TestCase):
                 to_storage_class="NotAClass",
             )
 
+    def test_mapping_file(self) -> None:
+        """Update storage classes using YAML and CSV mapping files."""
+        butler_root = self.make_butler()
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        dimensions = DimensionGroup(butler.dimensions)
+        for name in ("a_metadata", "b_other", "c_config"):
+            butler.registry.registerDatasetType(
+                DatasetType(name=name, dimensions=dimensions, storageClass="StructuredDataDict")
+            )
+
+        yaml_file = os.path.join(self.root, "mapping.yaml")
+        with open(yaml_file, "w") as file:
+            file.write(
+                "- {dataset_type: '*_metadata', from: StructuredDataDict, to: Packages}\n"
+                "- {dataset_type: c_config, from: StructuredDataDict, to: ArrowNumpyDict}\n"
+            )
+        update_storage_class(repo=butler_root, update=True, mapping_file=yaml_file)
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        new_storage_classes = {
+            "a_metadata": "Packages",
+            "b_other": "StructuredDataDict",
+            "c_config": "ArrowNumpyDict",
+        }
+        for name, storage_class in new_storage_classes.items():
+            self.assertEqual(butler.get_dataset_type(name).storageClass.name, storage_class)
+
+        # Conflicting mappings for the same dataset type.
+        csv_file = os.path.join(self.root, "mapping.csv")
+        with open(csv_file, "w") as file:
+            file.write(
+                "dataset_type,from,to\n*,StructuredDataDict,Packages\nb_*,StructuredDataDict,ArrowNumpyDict\n"
+            )
+        with self.assertRaisesRegex(ValueError, "b_other matches mappings to different storage classes"):
+            update_storage_class(repo=butler_root, update=True, mapping_file=csv_file)
+
+        # Any bad mapping stops all updates.
+        with open(csv_file, "w") as file:
+            file.write(
+                "dataset_type,from,to\nb_other,StructuredDataDict,Packages\nc_config,ArrowNumpyDict,NotAClass\n"
+            )
+        with self.assertRaisesRegex(ValueError, "Storage class NotAClass does not exist"):
+            update_storage_class(repo=butler_root, update=True, mapping_file=csv_file)
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        self.assertEqual(butler.get_dataset_type("b_other").storageClass.name, "StructuredDataDict")
+
+        # Mapping file cannot be mixed with arguments.
+        with self.assertRaisesRegex(ValueError, "cannot be used with mapping file"):
+            update_storage_class(repo=butler_root, update=True, dataset_type="*", mapping_file=csv_file)
+
+    def test_validate(self) -> None:
+        """Read existing datasets with new storage class before update."""
+        butler_root = self.make_butler()
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        dimensions = DimensionGroup(butler.dimensions)
+        butler.registry.registerDatasetType(
+            DatasetType(name="a_metadata", dimensions=dimensions, storageClass="StructuredDataDict")
+        )
+        refs = []
+        for index in range(3):
+            butler.collections.register(f"run{index}")
+            refs.append(butler.put({"value": index}, "a_metadata", run=f"run{index}"))
+
+        # Missing artifact cannot be read, database is not updated.
+        os.remove(butler.getURI(refs[0]).ospath)
+        output = io.StringIO()
+        with (
+            contextlib.redirect_stdout(output),
+            self.assertRaisesRegex(RuntimeError, "1 dataset could not be read"),
+        ):
+            update_storage_class(
+                repo=butler_root,
+                update=True,
+                dataset_type="*_metadata",
+                storage_class="StructuredDataDict",
+                to_storage_class="Packages",
+                validate=10,
+                jobs=2,
+            )
+        self.assertIn("a_metadata: read 2 of 3 datasets with Packages", output.getvalue())
+        self.assertIn(f"{refs[0]}: FileNotFoundError", output.getvalue())
+        with Butler.from_config(butler_root) as new_butler:
+            self.assertEqual(
+                new_butler.get_dataset_type("a_metadata").storageClass.name, "StructuredDataDict"
+            )
+
+        # Sample only includes datasets that are in datastore.
+        butler.pruneDatasets([refs[0]], purge=True, unstore=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            update_storage_class(
+                repo=butler_root,
+                update=True,
+                dataset_type="*_metadata",
+                storage_class="StructuredDataDict",
+                to_storage_class="Packages",
+                validate=10,
+                jobs=2,
+            )
+        self.assertIn("Read 2 datasets", output.getvalue())
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        self.assertEqual(butler.get_dataset_type("a_metadata").storageClass.name, "Packages")
+
+    def test_dry_run(self) -> None:
+        """Report affected datasets without updating."""
+        butler_root = self.make_butler()
+
+        butler = Butler.from_config(butler_root, writeable=True)
+        self.enterContext(butler)
+        dimensions = DimensionGroup(butler.dimensions)
+        for name in ("a_metadata", "b_metadata"):
+            butler.registry.registerDatasetType(
+                DatasetType(name=name, dimensions=dimensions, storageClass="StructuredDataDict")
+            )
+        sizes = 0
+        for run in ("run1", "run2"):
+            butler.collections.register(run)
+            ref = butler.put({"value": run}, "a_metadata", run=run)
+            sizes += butler.getURI(ref).size()
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            update_storage_class(
+                repo=butler_root,
+                update=False,
+                dataset_type="*_metadata",
+                storage_class="StructuredDataDict",
+                to_storage_class="Packages",
+            )
+        self.assertIn(
+            f"a_metadata: StructuredDataDict -> Packages (2 datasets in 2 RUN collections, {sizes} B)",
+            output.getvalue(),
+        )
+        self.assertIn(
+            "b_metadata: StructuredDataDict -> Packages (0 datasets in 0 RUN collections, 0 B)",
+            output.getvalue(),
+        )
+        self.assertIn(f"Total: 2 datasets, {sizes} B", output.getvalue())
+        self.assertIn("Database was not updated", output.getvalue())
+
 
 if __name__ == "__main__":
     unittest.main()